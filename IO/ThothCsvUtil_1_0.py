@@ -1,12 +1,35 @@
 import csv
+import glob
+import hashlib
+import io
+import itertools
+import os
+import multiprocessing
+import tempfile
+import time
+import numpy as np
 
 VERSION = (1,0,0)
 
+# rows parsed per step of the typed readers
+BLOCK_ROWS = 2**16
+# bytes per job of the parallel reader
+RANGE_BYTES = 2**25
+
 class CsvLoader:
     """
     Examples are shown below:
         datapoints = np.array(CsvLoader.read_plain_from_file('Data/datapoints.csv'), dtype=int)
         classes    = np.array(CsvLoader.read_plain_ith_column('Data/class_annotations.csv', 0), dtype=int)
+    
+    Typed, without the intermediate lists of str (large files):
+        datapoints = CsvLoader.read_typed('Data/datapoints.csv', dtype=int)
+        trace      = CsvLoader.read_typed('Data/trace.csv', dtype=[('time', float), ('id', int)], skiprows=1)
+        for block in CsvLoader.read_typed('Data/trace.csv', dtype=float, chunksize=10**6):
+            ...
+        time, size = CsvLoader.read_columns('Data/trace.csv', ['time', 'size'], [float, int], header=True)
+        datapoints = CsvLoader.read_parallel('Data/datapoints.csv', dtype=int, workers=4)
+        datapoints = CsvLoader.read_cached('Data/datapoints.csv', dtype=int)   # parsed once, then memory mapped
     """	
     @staticmethod
     def read_plain_from_file(path, delimiter=','):
@@ -25,4 +48,337 @@ class CsvLoader:
             data = []
             for row in datareader:
                 data.append(row[column])
-        return data
\ No newline at end of file
+        return data
+    
+    @staticmethod
+    def _line_blocks(csvfile, block_rows, quotechar='|'):
+        # blocks of ~block_rows lines, a block never ends inside a quoted field
+        while True:
+            lines = list(itertools.islice(csvfile, block_rows))
+            if not lines:
+                return
+            quotes = sum(line.count(quotechar) for line in lines)
+            while quotes % 2:
+                # a quoted field spans the block border
+                line = csvfile.readline()
+                if not line:
+                    break
+                lines.append(line)
+                quotes += line.count(quotechar)
+            yield lines
+    
+    @staticmethod
+    def _parse_block(lines, dtype, delimiter):
+        # C parser of numpy, no python object per field
+        structured = np.dtype(dtype).names is not None
+        return np.loadtxt(lines, dtype=dtype, delimiter=delimiter, quotechar='|', comments=None, 
+                          ndmin=1 if structured else 2)
+    
+    @staticmethod
+    def read_typed(path, dtype=float, delimiter=',', skiprows=0, chunksize=None, block_rows=BLOCK_ROWS):
+        """
+        dtype       = one numpy dtype for all fields           -> 2d array (rows x columns)
+                      or a schema [('time', float), ('id', int)] -> structured 1d array (one field per column)
+        [skiprows]  = number of lines to skip (e.g. 1 for a header)
+        [chunksize] = None: returns the whole array
+                      int:  returns a generator of arrays of up to chunksize rows (out-of-core processing)
+        
+        Parses block_rows lines at a time into a preallocated buffer, the buffer is 
+        sized from the file size and grows by doubling if the estimate is too small.
+        """
+        if chunksize is not None:
+            return CsvLoader._read_typed_chunks(path, dtype, delimiter, skiprows, chunksize)
+        file_size = os.path.getsize(path)
+        with open(path) as csvfile:
+            for _ in range(skiprows):
+                csvfile.readline()
+            out, n = None, 0
+            for lines in CsvLoader._line_blocks(csvfile, block_rows):
+                block = CsvLoader._parse_block(lines, dtype, delimiter)
+                if out is None:
+                    # rows ≈ file size / mean line length of the first block
+                    line_bytes = max(sum(len(line) for line in lines) / len(lines), 1)
+                    capacity = max(int(file_size / line_bytes * 1.05) + 1, block.shape[0])
+                    out = np.empty((capacity,) + block.shape[1:], dtype=block.dtype)
+                elif block.shape[1:] != out.shape[1:]:
+                    raise ValueError("Rows with {} and {} columns in {}".format(out.shape[1], block.shape[1], path))
+                out = CsvLoader._append(out, n, block)
+                n += block.shape[0]
+        if out is None:
+            return CsvLoader._parse_block([], dtype, delimiter)
+        out.resize((n,) + out.shape[1:], refcheck=False)
+        return out
+    
+    @staticmethod
+    def _append(out, n, block):
+        # out[n:n+len(block)] = block, doubles the buffer if needed
+        if n + block.shape[0] > out.shape[0]:
+            out.resize((max(2 * out.shape[0], n + block.shape[0]),) + out.shape[1:], refcheck=False)
+        out[n:n + block.shape[0]] = block
+        return out
+    
+    @staticmethod
+    def _read_typed_chunks(path, dtype, delimiter, skiprows, chunksize):
+        with open(path) as csvfile:
+            for _ in range(skiprows):
+                csvfile.readline()
+            for lines in CsvLoader._line_blocks(csvfile, chunksize):
+                yield CsvLoader._parse_block(lines, dtype, delimiter)
+    
+    @staticmethod
+    def read_columns(path, columns, dtypes=float, delimiter=',', header=False, where=None, 
+                     skiprows=0, max_rows=None, block_rows=BLOCK_ROWS):
+        """
+        Reads only some columns, returns one typed array per column.
+        
+        columns    = column indices or names (names need header=True), e.g. [0, 3] or ['time', 'size']
+        [dtypes]   = one dtype for all columns or one per column
+        [header]   = True: the first line (after skiprows) holds the column names
+        [where]    = vectorized row filter, called with the arrays of the requested 
+                     columns of a block, returns a bool mask, e.g. where=lambda time, size: size > 0
+        [skiprows] = number of lines to skip before the header/data
+        [max_rows] = maximum number of data rows to read (before filtering)
+        
+        example:
+            time, size = CsvLoader.read_columns('Data/trace.csv', ['time', 'size'], [float, int], 
+                                                header=True, where=lambda time, size: time >= 100.0)
+        
+        Only the requested fields are converted (the numpy C parser still tokenizes the 
+        rest of the line, which is cheaper than splitting it in python).
+        """
+        if isinstance(dtypes, (list, tuple)):
+            if len(dtypes) != len(columns):
+                raise ValueError("{} dtypes for {} columns".format(len(dtypes), len(columns)))
+        else:
+            dtypes = [dtypes] * len(columns)
+        file_size = os.path.getsize(path)
+        with open(path) as csvfile:
+            for _ in range(skiprows):
+                csvfile.readline()
+            if header:
+                names = next(csv.reader([csvfile.readline()], delimiter=delimiter, quotechar='|'))
+                names = [name.strip() for name in names]
+                indices = []
+                for column in columns:
+                    if isinstance(column, str):
+                        if column not in names:
+                            raise ValueError("No column {} in {} (columns: {})".format(column, path, names))
+                        indices.append(names.index(column))
+                    else:
+                        indices.append(column)
+            elif any(isinstance(column, str) for column in columns):
+                raise ValueError("Column names need header=True")
+            else:
+                indices = list(columns)
+            
+            if len(set(indices)) != len(indices):
+                raise ValueError("Columns requested twice: {}".format(columns))
+            # one structured field per requested column, usecols keeps the order of the fields
+            order = sorted(range(len(indices)), key=lambda c: indices[c])
+            dtype = [('c{}'.format(c), dtypes[c]) for c in order]
+            usecols = [indices[c] for c in order]
+            
+            outs, n, rows_read = None, 0, 0
+            for lines in CsvLoader._line_blocks(csvfile, block_rows):
+                block = np.loadtxt(lines, dtype=dtype, delimiter=delimiter, quotechar='|', comments=None, 
+                                   usecols=usecols, ndmin=1)
+                if max_rows is not None:
+                    block = block[:max_rows - rows_read]
+                rows_read += block.shape[0]
+                block_columns = [block['c{}'.format(c)] for c in range(len(indices))]
+                if where is not None:
+                    mask = np.asarray(where(*block_columns), dtype=bool)
+                    block_columns = [column[mask] for column in block_columns]
+                if outs is None:
+                    line_bytes = max(sum(len(line) for line in lines) / len(lines), 1)
+                    capacity = max(int(file_size / line_bytes * 1.05) + 1, block_columns[0].shape[0])
+                    if max_rows is not None:
+                        capacity = max(min(capacity, max_rows), block_columns[0].shape[0])
+                    outs = [np.empty(capacity, dtype=column.dtype) for column in block_columns]
+                outs = [CsvLoader._append(out, n, column) for out, column in zip(outs, block_columns)]
+                n += block_columns[0].shape[0]
+                if max_rows is not None and rows_read >= max_rows:
+                    break
+        if outs is None:
+            return [np.empty(0, dtype=dt) for dt in dtypes]
+        for out in outs:
+            out.resize(n, refcheck=False)
+        return outs
+    
+    @staticmethod
+    def split_ranges(path, range_bytes=RANGE_BYTES, start=0, quotechar='|'):
+        """
+        Splits the file (from byte start on) into byte ranges [(begin, end), ...] of about 
+        range_bytes, each ending after a newline that is not inside a quoted field.
+        The quote parity is counted from start, i.e. over the whole file (C speed).
+        """
+        quote, newline = quotechar.encode(), b'\n'
+        size = os.path.getsize(path)
+        ranges = []
+        with open(path, 'rb') as f:
+            begin = start
+            while begin < size:
+                target = begin + range_bytes
+                if target >= size:
+                    ranges.append((begin, size))
+                    break
+                # quotes in [begin, target), begin itself is outside of quotes
+                f.seek(begin)
+                quotes = f.read(target - begin).count(quote)
+                pos, end = target, size
+                while pos < size and end == size:
+                    piece = f.read(2**16)
+                    offset = 0
+                    while True:
+                        nl = piece.find(newline, offset)
+                        if nl < 0:
+                            quotes += piece.count(quote, offset)
+                            break
+                        quotes += piece.count(quote, offset, nl)
+                        if quotes % 2 == 0:
+                            end = pos + nl + 1
+                            break
+                        offset = nl + 1
+                    pos += len(piece)
+                ranges.append((begin, end))
+                begin = end
+        return ranges
+    
+    @staticmethod
+    def read_parallel(path, dtype=float, delimiter=',', skiprows=0, workers=None, 
+                      range_bytes=RANGE_BYTES, encoding='utf-8'):
+        """
+        Like read_typed, but the byte ranges of split_ranges are parsed in a process pool 
+        (workers: None = all cores, 1 = no pool) and concatenated in file order.
+        """
+        with open(path, 'rb') as f:
+            for _ in range(skiprows):
+                f.readline()
+            start = f.tell()
+        jobs = [(path, begin, end, dtype, delimiter, encoding) for begin, end in 
+                CsvLoader.split_ranges(path, range_bytes, start)]
+        if workers == 1:
+            blocks = map(_parse_byte_range, jobs)
+            return CsvLoader._concat_blocks(blocks, dtype, delimiter)
+        with multiprocessing.Pool(workers) as pool:
+            # imap keeps the order, the blocks are copied as soon as they arrive
+            return CsvLoader._concat_blocks(pool.imap(_parse_byte_range, jobs), dtype, delimiter)
+    
+    @staticmethod
+    def _concat_blocks(blocks, dtype, delimiter):
+        out, n = None, 0
+        for block in blocks:
+            if block.shape[0] == 0:
+                continue
+            if out is None:
+                out = np.empty((2 * block.shape[0],) + block.shape[1:], dtype=block.dtype)
+            elif block.shape[1:] != out.shape[1:]:
+                raise ValueError("Rows with {} and {} columns".format(out.shape[1], block.shape[1]))
+            out = CsvLoader._append(out, n, block)
+            n += block.shape[0]
+        if out is None:
+            return CsvLoader._parse_block([], dtype, delimiter)
+        out.resize((n,) + out.shape[1:], refcheck=False)
+        return out
+
+    @staticmethod
+    def cache_path(path, dtype=float, delimiter=',', skiprows=0, cache_dir=None):
+        """
+        .npy sidecar of the parsed file: 
+            <cache_dir>/.<file name>.<hash of the parse options>.<size>-<mtime_ns>.npy
+        (cache_dir = None: next to the file)
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        options = repr((path, np.dtype(dtype).descr, delimiter, skiprows)).encode()
+        directory = os.path.dirname(path) if cache_dir is None else cache_dir
+        return os.path.join(directory, ".{}.{}.{}-{}.npy".format(
+            os.path.basename(path), hashlib.sha1(options).hexdigest()[:16], stat.st_size, stat.st_mtime_ns))
+    
+    @staticmethod
+    def read_cached(path, dtype=float, delimiter=',', skiprows=0, workers=1, cache_dir=None):
+        """
+        read_typed (workers=1) or read_parallel (workers != 1) with a parse cache:
+        the array is written to a .npy sidecar (see cache_path), later calls with the 
+        same options on the unchanged file (size, mtime) only map the sidecar, 
+        i.e. np.load(mmap_mode='r'), the result is read only.
+        Sidecars of older versions of the file (same options) are removed.
+        """
+        sidecar = CsvLoader.cache_path(path, dtype, delimiter, skiprows, cache_dir)
+        if not os.path.exists(sidecar):
+            if workers == 1:
+                data = CsvLoader.read_typed(path, dtype, delimiter, skiprows)
+            else:
+                data = CsvLoader.read_parallel(path, dtype, delimiter, skiprows, workers)
+            # unique temporary file in the same directory, moved into place atomically:
+            # a concurrent reader sees either no sidecar or a complete one
+            fd, temp = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(sidecar) + '.', 
+                                        dir=os.path.dirname(sidecar))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, data)
+                os.replace(temp, sidecar)
+            except BaseException:
+                os.remove(temp)
+                raise
+            # stale versions differ only in the <size>-<mtime_ns> part (removed after the 
+            # replace, open memory maps of them stay valid)
+            for stale in glob.glob(glob.escape(sidecar.rsplit('.', 2)[0]) + '.*.npy'):
+                if stale != sidecar:
+                    try:
+                        os.remove(stale)
+                    except FileNotFoundError:
+                        pass   # removed by a concurrent reader
+        return np.load(sidecar, mmap_mode='r')
+
+
+def _parse_byte_range(job):
+    path, begin, end, dtype, delimiter, encoding = job
+    with open(path, 'rb') as f:
+        f.seek(begin)
+        data = f.read(end - begin)
+    # same line splitting as open(path) in read_typed (str.splitlines would also split at \x0c, \x1e, \u2028, ...)
+    lines = list(io.TextIOWrapper(io.BytesIO(data), encoding=encoding))
+    return CsvLoader._parse_block(lines, dtype, delimiter)
+
+#------------------------------------------------------------------------------------------------------
+
+#-------------------------------------------    Playground  ------------------------------------------
+
+#------------------------------------------------------------------------------------------------------
+
+def benchmark_parallel_loading(path='/tmp/thoth_benchmark.csv', rows=2*10**6, columns=8):
+    """ read_parallel with 1, 2, 4 and 8 workers against read_plain_from_file """
+    if not os.path.exists(path):
+        data = np.random.randint(0, 10**6, (rows, columns))
+        np.savetxt(path, data, fmt='%d', delimiter=',')
+    print("file: {} ({:.0f} MB)".format(path, os.path.getsize(path) / 1e6))
+    
+    start = time.perf_counter()
+    reference = np.array(CsvLoader.read_plain_from_file(path), dtype=int)
+    print("read_plain_from_file + np.array: {:.2f}s".format(time.perf_counter() - start))
+    start = time.perf_counter()
+    CsvLoader.read_typed(path, dtype=int)
+    print("read_typed:                      {:.2f}s".format(time.perf_counter() - start))
+    for workers in [1, 2, 4, 8]:
+        start = time.perf_counter()
+        data = CsvLoader.read_parallel(path, dtype=int, workers=workers)
+        print("read_parallel, {} workers:        {:.2f}s (equal: {})".format(
+            workers, time.perf_counter() - start, np.array_equal(data, reference)))
+
+
+def check_parallel_line_breaks(path='/tmp/thoth_line_breaks.csv'):
+    """ fields with characters str.splitlines breaks at parse the same in parallel and serial mode """
+    schema = [('id', int), ('label', 'U16')]
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(2000):
+            f.write("{},a{}b\n".format(i, ['\x0b', '\x0c', '\x1c', '\x1d', '\x1e', '\x85', '\u2028', '\u2029'][i % 8]))
+    serial = CsvLoader.read_typed(path, schema)
+    parallel = CsvLoader.read_parallel(path, schema, workers=2, range_bytes=4096)
+    assert serial.shape == (2000,) and np.array_equal(serial, parallel), (serial[:3], parallel[:3])
+    os.remove(path)
+    print("parallel line breaks: ok")
+
+#uncomment to test
+#benchmark_parallel_loading()
+#check_parallel_line_breaks()
@@ -6,8 +6,318 @@ Created on Fri Feb 25 20:21:12 2020
 
 This framework should help outputting and debugging using output levels.
 (level of abstraction)
+
+Messages above the output level are rejected before any formatting, so debug calls
+can stay in hot loops. Expensive values can be passed lazily:
+    dof.var("matrix", Lazy(repr, big_array), 9)              # called only if printed
+    dof.info("iteration %d: error %.3e", 9, args=(i, err))   # %-formatted only if printed
+
+The lines go to a sink (default: stdout), see "Sinks" below:
+    dof = DebugOutputFormatter(debug_level=5, sink=QueueSink(FileSink('debug.log')))
 """
 
+import sys
+import time
+import threading
+import traceback
+import queue
+import collections
+import multiprocessing
+
+#------------------------------------------------------------------------------------------------------ 
+        
+#---------------------------------------   Sinks ------------------------------------------------------ 
+
+
+#------------------------------------------------------------------------------------------------------ 
+
+class Sink:
+    """
+    Destination of the output lines:
+        write(line)         one line (without newline)
+        write_batch(lines)  many lines at once (sinks with I/O write them in one call)
+        flush()             pushes buffered lines through
+        close()             flushes and releases the resources
+    Sinks are context managers (close on exit).
+    """
+    def write(self, line):
+        raise NotImplementedError("{} does not implement write()".format(type(self).__name__))
+    
+    def write_batch(self, lines):
+        for line in lines:
+            self.write(line)
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self.flush()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class StdoutSink(Sink):
+    """ writes every line immediately (same as print), default sink """
+    def __init__(self, stream=None):
+        self.stream = stream
+    
+    def __target(self):
+        # sys.stdout at write time, so redirections of stdout are respected
+        return self.stream if self.stream is not None else sys.stdout
+    
+    def write(self, line):
+        self.__target().write(line + "\n")
+    
+    def write_batch(self, lines):
+        if lines:
+            self.__target().write("\n".join(lines) + "\n")
+    
+    def flush(self):
+        self.__target().flush()
+
+
+class RingBufferSink(Sink):
+    """ keeps the last n lines in memory, e.g. for a post-mortem dump after an exception """
+    def __init__(self, n=10000):
+        self.buffer = collections.deque(maxlen=n)
+    
+    def __len__(self):
+        return len(self.buffer)
+    
+    def write(self, line):
+        self.buffer.append(line)
+    
+    def write_batch(self, lines):
+        self.buffer.extend(lines)
+    
+    def lines(self):
+        return list(self.buffer)
+    
+    def dump(self, sink=None, clear=True):
+        """ writes the kept lines to sink (default: stdout) """
+        sink = StdoutSink() if sink is None else sink
+        sink.write_batch(self.lines())
+        sink.flush()
+        if clear:
+            self.buffer.clear()
+
+
+class FileSink(Sink):
+    """
+    Block-buffered file output: the lines are collected and written in one call 
+    when buffer_lines are reached or the last write is longer than flush_interval 
+    seconds ago (checked on write, i.e. there is no timer thread).
+    """
+    def __init__(self, path, mode="a", buffer_lines=1000, flush_interval=1.0, encoding="utf-8"):
+        self.path = path
+        self.file = open(path, mode, encoding=encoding)
+        self.buffer_lines = buffer_lines
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush = time.monotonic()
+    
+    def __str__(self):
+        return "<FileSink {} pending:{}>".format(self.path, len(self.pending))
+    
+    def write(self, line):
+        self.pending.append(line)
+        if len(self.pending) >= self.buffer_lines or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+    
+    def write_batch(self, lines):
+        self.pending.extend(lines)
+        if len(self.pending) >= self.buffer_lines or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+    
+    def flush(self):
+        if self.pending:
+            self.file.write("\n".join(self.pending) + "\n")
+            self.pending = []
+        self.file.flush()
+        self.last_flush = time.monotonic()
+    
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class QueueSink(Sink):
+    """
+    Hands the lines to a background thread that writes them to target in batches 
+    (up to batch_size lines per write_batch), so the caller never waits for I/O.
+    
+    maxsize = bound of the queue (lines)
+    policy  = "block": write() waits while the queue is full
+              "drop":  write() drops the line while the queue is full (counted in dropped)
+    
+    A batch the target fails to write is reported on stderr and counted in errors,
+    the thread keeps draining (flush() never waits for a dead thread).
+    """
+    POLICIES = ("block", "drop")
+    
+    def __init__(self, target, maxsize=10000, policy="block", batch_size=1000):
+        if policy not in QueueSink.POLICIES:
+            raise ValueError("No such policy: {}. Choose one of {}".format(policy, QueueSink.POLICIES))
+        self.target = target
+        self.queue = queue.Queue(maxsize)
+        self.policy = policy
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.errors = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.__drain, daemon=True)
+        self.thread.start()
+    
+    def __str__(self):
+        return "<QueueSink queued:{}, dropped:{}, errors:{}>".format(self.queue.qsize(), self.dropped, self.errors)
+    
+    def __drain(self):
+        get, get_nowait = self.queue.get, self.queue.get_nowait
+        while True:
+            batch = [get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(get_nowait())
+            except queue.Empty:
+                pass
+            stop = batch[-1] is None
+            lines = batch[:-1] if stop else batch
+            try:
+                self.target.write_batch(lines)
+                if self.queue.empty():
+                    self.target.flush()
+            except Exception:
+                # the lines are lost, but the thread survives (otherwise flush() would wait forever)
+                self.errors += 1
+                sys.stderr.write("QueueSink: {} lines not written to {}\n".format(len(lines), self.target))
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if stop:
+                return
+    
+    def write(self, line):
+        if self.policy == "block":
+            self.queue.put(line)
+        else:
+            try:
+                self.queue.put_nowait(line)
+            except queue.Full:
+                self.dropped += 1
+    
+    def flush(self):
+        """ waits until the background thread has written all queued lines """
+        if not self.thread.is_alive():
+            if self.queue.unfinished_tasks:
+                raise RuntimeError("The thread of the QueueSink is not running, {} lines are not written".format(
+                                   self.queue.qsize()))
+            return
+        self.queue.join()
+        
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+            self.target.close()
+
+
+class MultiprocessSink(Sink):
+    """
+    Funnels the output of worker processes to a single writer: a thread of the 
+    creating process reads line batches from a multiprocessing queue and writes 
+    them to target, so lines of different processes never interleave.
+    
+    In the workers use worker_sink() (batches lines locally, one queue message per batch):
+        sink = MultiprocessSink(FileSink('debug.log'))
+        # pass sink.worker_sink(prefix) to the worker (Process args or Pool initializer,
+        # with manager=True also as argument of pool.map), in the worker:
+        dof = DebugOutputFormatter(sink=worker_sink)   ...   worker_sink.close()
+    
+    maxsize = bound of the queue (batches)
+    manager = True: queue of a multiprocessing.Manager, which can be pickled into any 
+              call (slower), False: plain multiprocessing.Queue (inherited by the worker)
+    """
+    def __init__(self, target, maxsize=1000, manager=False):
+        self.target = target
+        self.manager = multiprocessing.Manager() if manager else None
+        self.queue = self.manager.Queue(maxsize) if manager else multiprocessing.Queue(maxsize)
+        self.closed = False
+        self.thread = threading.Thread(target=self.__drain, daemon=True)
+        self.thread.start()
+    
+    def __drain(self):
+        while True:
+            lines = self.queue.get()
+            if lines is None:
+                self.target.flush()
+                return
+            self.target.write_batch(lines)
+    
+    def worker_sink(self, prefix=None, batch_size=100, flush_interval=0.5, policy="block"):
+        """ sink for a worker process, prefix (e.g. the worker name) is put in front of every line """
+        return WorkerSink(self.queue, prefix, batch_size, flush_interval, policy)
+    
+    def write(self, line):
+        # lines of the creating process itself
+        self.queue.put([line])
+    
+    def write_batch(self, lines):
+        self.queue.put(list(lines))
+    
+    def close(self):
+        """ call after all workers have closed their sinks """
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+            self.target.close()
+            if self.manager is not None:
+                self.manager.shutdown()
+
+
+class WorkerSink(Sink):
+    """
+    Worker side of a MultiprocessSink: collects lines and sends them as one batch 
+    when batch_size lines are reached or flush_interval seconds have passed.
+    policy "drop" drops whole batches while the queue is full (counted in dropped).
+    """
+    def __init__(self, batch_queue, prefix=None, batch_size=100, flush_interval=0.5, policy="block"):
+        if policy not in QueueSink.POLICIES:
+            raise ValueError("No such policy: {}. Choose one of {}".format(policy, QueueSink.POLICIES))
+        self.queue = batch_queue
+        self.prefix = "" if prefix is None else "[{}] ".format(prefix)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.pending = []
+        self.dropped = 0
+        self.last_flush = time.monotonic()
+    
+    def write(self, line):
+        self.pending.append(self.prefix + line)
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+    
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        if self.policy == "block":
+            self.queue.put(batch)
+        else:
+            try:
+                self.queue.put_nowait(batch)
+            except queue.Full:
+                self.dropped += len(batch)
+
 #------------------------------------------------------------------------------------------------------ 
         
 #---------------------------------------   Standard output -------------------------------------------- 
@@ -16,6 +326,21 @@ This framework should help outputting and debugging using output levels.
 #------------------------------------------------------------------------------------------------------ 
 
 
+class Lazy:
+    """
+    Value computed only if the message is printed: Lazy(fn, *args) -> fn(*args)
+    (plain callables are printed as they are, e.g. dof.var("type", int, 1))
+    """
+    __slots__ = ("fn", "args")
+    
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+    
+    def __call__(self):
+        return self.fn(*self.args)
+
+
 class DebugOutputFormatter():
     """
     debug_level ∈ [1,10], decribes the proirity
@@ -24,27 +349,47 @@ class DebugOutputFormatter():
         4-6  = detailed outputs, helpful for debugging and in extreme cases for productive
         7-8  = for debugging purposes, high level implementation output
         9-10 = for debugging purposes, (very) low level implementation output
+    
+    sink = where the lines go (see Sink), None = stdout
     """
-    def __init__(self, debug_level=10, output_length=60, fill_line=' ', var_field_length=25):
+    def __init__(self, debug_level=10, output_length=60, fill_line=' ', var_field_length=25, sink=None):
         self.debug_level = debug_level
         self.output_length = output_length
         self.fill_line = fill_line
         self.var_field_length = var_field_length
+        self.sink = StdoutSink() if sink is None else sink
     
     def __str__(self):
         return "<DebugOutputFormatter object, output_level:{}>".format(self.debug_level)
     
     def __print_if_level_fit(self, text, prio):
         if prio <= self.debug_level:
-            print(text)
+            self.sink.write(text)
+    
+    def enabled(self, debug_level):
+        """ True if messages of this level are printed, e.g. to guard whole debug blocks """
+        return debug_level <= self.debug_level
+    
+    @staticmethod
+    def _resolve(value, args):
+        # lazy values: value % args, or the result of a Lazy
+        if args is not None:
+            return value % args
+        if type(value) is Lazy:
+            return value()
+        return value
         
-    def info(self, value, debug_level, info_key="[INFO]", align="r"):
+    def info(self, value, debug_level, info_key="[INFO]", align="r", args=None):
         """
-        value       = the message
+        value       = the message (or a Lazy returning it)
         debug_level = output level 
         [info_key]  = label frame for output 
         [align]     = either "r", "l", "rx" or "lx" where x is an integer
+        [args]      = %-style arguments, the message is value % args
         """
+        if debug_level > self.debug_level:
+            return
+        value = str(DebugOutputFormatter._resolve(value, args))
         
         DEFAULT_RIGHT_INTENDENT = 0
         DEFAULT_LEFT_INTENDENT = 3
@@ -56,35 +401,39 @@ class DebugOutputFormatter():
             if len(align) > 1:
                 intendent = int(str(align[1:]))
             right = intendent
-            left = max(self.output_length - right - KEY_TO_VALUE_INTENDENT- len(str(info_key)) - len(str(value)) , 0)
+            left = max(self.output_length - right - KEY_TO_VALUE_INTENDENT- len(str(info_key)) - len(value) , 0)
             output = "{}{}{}{}{}".format(left*fill_line, value, KEY_TO_VALUE_INTENDENT*fill_line, info_key, right*fill_line) 
         elif align[0] == 'l':
             intendent = DEFAULT_LEFT_INTENDENT  
             if len(align) > 1:
                 intendent = int(str(align[1:]))
             left = intendent
-            right = max(self.output_length - left - KEY_TO_VALUE_INTENDENT -len(str(info_key)) - len(str(value)) , 0)
+            right = max(self.output_length - left - KEY_TO_VALUE_INTENDENT -len(str(info_key)) - len(value) , 0)
             output = "{}{}{}{}{}".format(left*fill_line, info_key, KEY_TO_VALUE_INTENDENT*fill_line, value, right*fill_line) 
         else:
             raise ValueError("align can only take values 'l', 'r', 'lx' or 'rx' where x is an integer")
             
         self.__print_if_level_fit(output, debug_level)
         
-    def var(self, varname, value, debug_level):
+    def var(self, varname, value, debug_level, args=None):
         """
         varname     = description of the variable
-        value       = value of the variable
+        value       = value of the variable (or a Lazy returning it)
         debug_level = output level 
+        [args]      = %-style arguments, the value is value % args
         
         a variable is per default left-aligned
         """
+        if debug_level > self.debug_level:
+            return
+        value = str(DebugOutputFormatter._resolve(value, args))
         
         DEFAULT_INTENDENT = 3
         fill_line = self.fill_line
 
         left = DEFAULT_INTENDENT 
         space = max(self.var_field_length - left - len(str(varname)) -1, 0)
-        right = max(self.output_length - left -space -len(str(varname)) -1 - len(str(value)), 0)
+        right = max(self.output_length - left -space -len(str(varname)) -1 - len(value), 0)
         output = "{}{}:{}{}{}".format(left*fill_line, varname, space*fill_line, value, right*fill_line) 
       
         
@@ -100,6 +449,8 @@ class DebugOutputFormatter():
                       "rx" (right, x times indented)
         prio        = defines an automatic indentend (for non-center align only, if no align defined 'left' is choosen)
         """
+        if debug_level > self.debug_level:
+            return
         DEFAULT_INTENDENT = 3
         PRIO_INTENDENT_STEP_SIZE= 2
         
@@ -135,6 +486,8 @@ class DebugOutputFormatter():
         self.__print_if_level_fit(output, debug_level)
         
     def empty(self, debug_level):
+        if debug_level > self.debug_level:
+            return
         self.__print_if_level_fit("", debug_level)
         
         
@@ -159,4 +512,97 @@ def print_example_code():
     dof.info("wichtig", 1)
     dof.info("also very important", 1)
 
-#print_example_code()
\ No newline at end of file
+#print_example_code()
+
+
+def benchmark_suppressed_calls(n=10**6):
+    """ cost of debug calls above the output level (eager vs. lazy values) """
+    import numpy as np
+    dof = DebugOutputFormatter(debug_level=1)
+    big = np.arange(10**5)
+    calls = [("info, plain str", lambda: dof.info("message", 9)),
+             ("var, int", lambda: dof.var("x", 7, 9)),
+             ("var, lazy repr", lambda: dof.var("big", Lazy(repr, big), 9)),
+             ("info, %-args", lambda: dof.info("error %.3e at %d", 9, args=(0.1, 7))),
+             ("chapter", lambda: dof.chapter("Question", "4", debug_level=9)),
+             ("guarded (enabled)", lambda: dof.enabled(9) and dof.var("big", repr(big), 9))]
+    loop = time.perf_counter()
+    for _ in range(n):
+        pass
+    loop = time.perf_counter() - loop
+    for name, call in calls:
+        start = time.perf_counter()
+        for _ in range(n):
+            call()
+        elapsed = time.perf_counter() - start - loop
+        print("{:20s} {:6.0f} ns/call".format(name, elapsed / n * 1e9))
+    start = time.perf_counter()
+    repr(big)
+    print("{:20s} {:6.0f} ns/call (paid if not lazy)".format("repr(big array)", (time.perf_counter() - start) * 1e9))
+
+#uncomment to test
+#benchmark_suppressed_calls()
+
+
+_worker_sink = None
+
+def _init_worker(sink):
+    global _worker_sink
+    _worker_sink = sink
+
+def _example_worker(i):
+    dof = DebugOutputFormatter(debug_level=5, sink=_worker_sink)
+    for step in range(3):
+        dof.var("worker {} step".format(i), step, 5)
+    _worker_sink.flush()
+    return i
+
+def example_sinks(path="debug_example.log"):
+    # post-mortem: keep the last lines, print them only if something goes wrong
+    ring = RingBufferSink(5)
+    dof = DebugOutputFormatter(debug_level=9, sink=ring)
+    for i in range(100):
+        dof.var("i", i, 9)
+    ring.dump()
+    
+    # the caller never waits for the file
+    with QueueSink(FileSink(path), policy="drop") as sink:
+        dof = DebugOutputFormatter(debug_level=9, sink=sink)
+        for i in range(10000):
+            dof.var("i", i, 9)
+    
+    # workers write through one writer (inherited by the pool workers via the initializer)
+    sink = MultiprocessSink(StdoutSink())
+    with multiprocessing.Pool(2, _init_worker, (sink.worker_sink(prefix="worker"),)) as pool:
+        pool.map(_example_worker, range(4))
+    sink.close()
+
+
+
+class _FailingSink(Sink):
+    # fails on every batch containing the line "bad" (for check_queue_sink_errors)
+    def __init__(self):
+        self.lines = []
+    
+    def write_batch(self, lines):
+        if "bad" in lines:
+            raise IOError("disk full")
+        self.lines.extend(lines)
+
+def check_queue_sink_errors():
+    """ a target that raises does not stop the QueueSink, flush() returns """
+    target = _FailingSink()
+    sink = QueueSink(target)
+    sink.write("bad")
+    sink.flush()
+    for i in range(100):
+        sink.write("line {}".format(i))
+    sink.flush()
+    sink.close()
+    assert sink.errors == 1 and target.lines == ["line {}".format(i) for i in range(100)], (sink, target.lines)
+    sink.flush()   # closed, returns immediately
+    print("queue sink errors: ok")
+
+#uncomment to test
+#example_sinks()
+#check_queue_sink_errors()
\ No newline at end of file
@@ -1,32 +1,9 @@
-import csv
+import mmap
+# local file, the CsvLoader lives in ThothCsvUtil
+from ThothCsvUtil_1_0 import CsvLoader
 
 VERSION = (1,0,0)
 
-class CsvLoader:
-    """
-    Examples are shown below:
-        datapoints = np.array(CsvLoader.read_plain_from_file('Data/datapoints.csv'), dtype=int)
-        classes    = np.array(CsvLoader.read_plain_ith_column('Data/class_annotations.csv', 0), dtype=int)
-    """	
-    @staticmethod
-    def read_plain_from_file(path, delimiter=','):
-        with open(path) as csvfile:
-            datareader = csv.reader(csvfile, delimiter=delimiter, quotechar='|')
-            data = []
-            for row in datareader:
-                data.append(row)
-        return data 
-	
-    
-    @staticmethod
-    def read_plain_ith_column(path, column, delimiter=','):
-        with open(path) as csvfile:
-            datareader = csv.reader(csvfile, delimiter=delimiter, quotechar='|')
-            data = []
-            for row in datareader:
-                data.append(row[column])
-        return data
-	
 class TextLoader:
     """
    
@@ -37,3 +14,67 @@ class TextLoader:
         text = datafile.read()
         datafile.close() 
         return text
+    
+    @staticmethod
+    def map(path):
+        """
+        Maps the file into memory instead of reading it (read only, the OS loads 
+        the pages on demand and keeps them in its cache for the next run).
+        
+        example:
+            with TextLoader.map('Data/trace.csv') as text:
+                header = bytes(text.buffer[:100])
+                for line in text.lines():
+                    ...
+        """
+        return MappedText(path)
+
+
+class MappedText:
+    """
+    buffer  = zero-copy memoryview of the bytes of the file
+    lines() = iterator over the lines (bytes, or str if an encoding is given)
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as datafile:
+            try:
+                self.mm = mmap.mmap(datafile.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                self.mm = None
+        self.buffer = memoryview(self.mm) if self.mm is not None else memoryview(b'')
+    
+    def __len__(self):
+        return len(self.buffer)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def close(self):
+        """
+        unmaps the file (can be called more than once). If slices of buffer are
+        still alive, the mapping is left to the garbage collector.
+        """
+        self.buffer.release()
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                # exported pointers exist (slices of buffer), closed when they are gone
+                pass
+            self.mm = None
+    
+    def lines(self, encoding=None):
+        if self.mm is None:
+            return
+        pos, size = 0, len(self.mm)
+        while pos < size:
+            end = self.mm.find(b'\n', pos)
+            end = size if end < 0 else end + 1
+            line = self.mm[pos:end]
+            yield line if encoding is None else line.decode(encoding)
+            pos = end
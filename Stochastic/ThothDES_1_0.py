@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:40:07 2026
+@author: Lukas Baur
+
+Kernel for discrete event simulations (DES).
+
+    - EventList:               future event list on a binary heap, O(log n) scheduling,
+                               cancellation is lazy (the event is only marked)
+    - Simulator:               clock + event list + main loop, handlers are called as handler(event)
+    - BlockSampler:            draws the samples of a distribution in blocks (Xn),
+                               so the model pays one numpy call per block instead of per sample
+    - TimeWeightedStatistic:   time average of a piecewise constant level (queue length,
+                               busy servers, ...), feeds interval averages into an Estimator
+
+example (M/M/1):
+    sim = Simulator()
+    interarrival = BlockSampler(ExponentialDistribution(0.8))
+    service = BlockSampler(ExponentialDistribution(1.0))
+    ...
+    def arrival(event):
+        sim.schedule(interarrival(), arrival)
+        ...
+    sim.schedule(interarrival(), arrival)
+    sim.run(max_events=10**6)
+
+see mmc_model() and benchmark_mmc() below
+"""
+
+import heapq
+import time
+from collections import deque
+
+#------------------------------------------------------------------------------------------------------
+
+#------------------------------------   Events --------------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------
+
+class Event:
+    """
+    time      = simulation time of the event
+    handler   = called as handler(event) when the event occurs
+    data      = payload of the model (e.g. the customer)
+    cancelled = set by EventList.cancel, the event is skipped
+    queued    = True while the event is in the event list (cancel ignores events that occurred)
+    """
+    __slots__ = ("time", "handler", "data", "cancelled", "queued")
+
+    def __init__(self, time, handler, data=None):
+        self.time = time
+        self.handler = handler
+        self.data = data
+        self.cancelled = False
+        self.queued = False
+
+    def __str__(self):
+        return "<Event t={} {}{}>".format(self.time, getattr(self.handler, "__name__", self.handler),
+                                          " cancelled" if self.cancelled else "")
+
+
+class EventList:
+    """
+    Future event list on a binary heap of (time, sequence number, event):
+    events with equal times occur in the order they were scheduled.
+
+    cancel() only marks the event (O(1)), it is dropped when it reaches the top.
+    Cancelling an event that already occurred (e.g. a timeout) does nothing.
+    If more than half of the heap is cancelled, the heap is rebuilt without them,
+    so the memory stays bounded by twice the number of pending events.
+    """
+    def __init__(self):
+        self.heap = []
+        self.seq = 0
+        self.n_cancelled = 0
+
+    def __len__(self):
+        return len(self.heap) - self.n_cancelled
+
+    def __str__(self):
+        return "<EventList pending:{}, cancelled:{}>".format(len(self), self.n_cancelled)
+
+    def schedule(self, event):
+        self.seq += 1
+        event.queued = True
+        heapq.heappush(self.heap, (event.time, self.seq, event))
+        return event
+
+    def cancel(self, event):
+        if event.cancelled or not event.queued:
+            return
+        event.cancelled = True
+        self.n_cancelled += 1
+        if self.n_cancelled > 32 and 2 * self.n_cancelled > len(self.heap):
+            # in place, Simulator.run holds a reference to the heap
+            self.heap[:] = [entry for entry in self.heap if not entry[2].cancelled]
+            heapq.heapify(self.heap)
+            self.n_cancelled = 0
+
+    def pop(self):
+        """ removes and returns the next pending event, None if there is none """
+        heap = self.heap
+        while heap:
+            event = heapq.heappop(heap)[2]
+            event.queued = False
+            if not event.cancelled:
+                return event
+            self.n_cancelled -= 1
+        return None
+
+    def next_time(self):
+        """ time of the next pending event, None if there is none """
+        heap = self.heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)[2].queued = False
+            self.n_cancelled -= 1
+        return heap[0][0] if heap else None
+
+#------------------------------------------------------------------------------------------------------
+
+#------------------------------------   Simulator -----------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------
+
+class Simulator:
+    """
+    now    = simulation clock
+    events = number of events processed so far
+
+    schedule(delay, handler, data) creates an event at now + delay,
+    run() calls handler(event) for all events in time order.
+    """
+    def __init__(self, start_time=0.0):
+        self.now = start_time
+        self.event_list = EventList()
+        self.events = 0
+        self.stopped = False
+
+    def __str__(self):
+        return "<Simulator now:{}, events:{}, {}>".format(self.now, self.events, self.event_list)
+
+    def schedule(self, delay, handler, data=None):
+        if delay < 0:
+            raise ValueError("Events cannot be scheduled in the past (delay={})".format(delay))
+        return self.event_list.schedule(Event(self.now + delay, handler, data))
+
+    def schedule_at(self, time, handler, data=None):
+        return self.schedule(time - self.now, handler, data)
+
+    def cancel(self, event):
+        self.event_list.cancel(event)
+
+    def stop(self):
+        """ ends run() after the current event """
+        self.stopped = True
+
+    def run(self, until=None, max_events=None):
+        """
+        processes events until the event list is empty, the next event is later
+        than until (the clock is then set to until), max_events events are
+        processed or a handler calls stop()
+
+        returns the number of events processed by this call
+        """
+        self.stopped = False
+        event_list = self.event_list
+        heap = event_list.heap
+        heappop = heapq.heappop
+        limit = float('inf') if until is None else until
+        remaining = -1 if max_events is None else max_events
+        processed = 0
+        # the main loop is inlined (pop, time check, dispatch), it dominates the run time
+        while heap and remaining != processed and not self.stopped:
+            if heap[0][0] > limit:
+                break
+            event = heappop(heap)[2]
+            event.queued = False
+            if event.cancelled:
+                event_list.n_cancelled -= 1
+                continue
+            self.now = event.time
+            processed += 1
+            event.handler(event)
+        if until is not None and not self.stopped and remaining != processed:
+            self.now = max(self.now, until)
+        self.events += processed
+        return processed
+
+#------------------------------------------------------------------------------------------------------
+
+#------------------------------------   Sampling & statistics -----------------------------------------
+
+#------------------------------------------------------------------------------------------------------
+
+class BlockSampler:
+    """
+    Draws block_size samples at once with dist.Xn and hands them out one by one
+    (as python floats, which are faster to compute with than numpy scalars).
+
+    sampler = BlockSampler(ExponentialDistribution(2))
+    x = sampler()
+    """
+    __slots__ = ("dist", "block_size", "block", "i")
+
+    def __init__(self, dist, block_size=4096):
+        self.dist = dist
+        self.block_size = block_size
+        self.block = []
+        self.i = 0
+
+    def __str__(self):
+        return "<BlockSampler {} block_size:{}>".format(self.dist, self.block_size)
+
+    def __call__(self):
+        i = self.i
+        if i == len(self.block):
+            self.block = self.dist.Xn(self.block_size).tolist()
+            i = 0
+        self.i = i + 1
+        return self.block[i]
+
+
+class TimeWeightedStatistic:
+    """
+    Time average of a piecewise constant level L(t) (e.g. number of customers in the system):
+        mean = 1/(t - t0) * ∫ L(s) ds
+    Call update(now, level) whenever the level changes.
+
+    [estimator] = Estimator/BatchMeansEstimator (ThothSamples_1_0), receives the time average
+                  of each interval of length interval (observations for a CI of the level),
+                  without an estimator the interval is ignored
+    """
+    def __init__(self, start_time=0.0, level=0.0, estimator=None, interval=None):
+        if estimator is not None and (interval is None or interval <= 0):
+            raise ValueError("An estimator needs an interval > 0")
+        self.start_time = start_time
+        self.last_time = start_time
+        self.level = level
+        self.area = 0.0
+        self.max_level = level
+        self.estimator = estimator
+        self.interval = interval
+        self.interval_end = start_time + interval if estimator is not None else float('inf')
+        self.interval_area = 0.0
+
+    def __str__(self):
+        return "<TimeWeightedStatistic mean:{}, level:{}>".format(self.mean(), self.level)
+
+    def __advance(self, now):
+        # integrates the current level up to now, closes all intervals on the way
+        while now >= self.interval_end:
+            part = self.level * (self.interval_end - self.last_time)
+            self.area += part
+            self.estimator.process_next_val((self.interval_area + part) / self.interval)
+            self.interval_area = 0.0
+            self.last_time = self.interval_end
+            self.interval_end += self.interval
+        part = self.level * (now - self.last_time)
+        self.area += part
+        self.interval_area += part
+        self.last_time = now
+
+    def update(self, now, level):
+        self.__advance(now)
+        self.level = level
+        if level > self.max_level:
+            self.max_level = level
+
+    def add(self, now, delta):
+        self.update(now, self.level + delta)
+
+    def reset(self, now):
+        """ discards everything before now (end of the warm-up period) """
+        self.start_time = self.last_time = now
+        self.area = 0.0
+        self.max_level = self.level
+        if self.estimator is not None:
+            self.interval_end = now + self.interval
+            self.interval_area = 0.0
+
+    def mean(self, now=None):
+        """ time average up to now (default: the last update) """
+        if now is not None:
+            self.__advance(now)
+        duration = self.last_time - self.start_time
+        return self.area / duration if duration > 0 else float('nan')
+
+#------------------------------------------------------------------------------------------------------
+
+#-------------------------------------------    Playground  ------------------------------------------
+
+#------------------------------------------------------------------------------------------------------
+
+def mmc_model(lam=0.9, mu=1.0, c=1, max_events=10**6, streams=None, warmup_events=0):
+    """
+    M/M/c queue (FIFO), returns (Simulator, waiting time estimator, number in system statistic)
+    utilization ρ = lam / (c * mu) has to be < 1
+    """
+    # local files
+    from ThothDistributions_1_1 import ExponentialDistribution
+    from ThothSamples_1_0 import BatchMeansEstimator
+
+    sim = Simulator()
+    interarrival = BlockSampler(ExponentialDistribution(lam, streams=streams))
+    service = BlockSampler(ExponentialDistribution(mu, streams=streams))
+    waiting = BatchMeansEstimator()
+    in_system = TimeWeightedStatistic(estimator=BatchMeansEstimator(), interval=100 / lam)
+    queue = deque()      # arrival times of the waiting customers
+    busy = 0
+
+    def arrival(event):
+        nonlocal busy
+        now = sim.now
+        sim.schedule(interarrival(), arrival)
+        in_system.update(now, in_system.level + 1)
+        if busy < c:
+            busy += 1
+            waiting.process_next_val(0.0)
+            sim.schedule(service(), departure)
+        else:
+            queue.append(now)
+
+    def departure(event):
+        nonlocal busy
+        now = sim.now
+        in_system.update(now, in_system.level - 1)
+        if queue:
+            waiting.process_next_val(now - queue.popleft())
+            sim.schedule(service(), departure)
+        else:
+            busy -= 1
+
+    sim.schedule(interarrival(), arrival)
+    if warmup_events:
+        sim.run(max_events=warmup_events)
+        waiting = BatchMeansEstimator()
+        in_system.reset(sim.now)
+        in_system.estimator = BatchMeansEstimator()
+    sim.run(max_events=max_events)
+    in_system.update(sim.now, in_system.level)
+    return sim, waiting, in_system
+
+
+def benchmark_mmc(events=10**7, lam=0.9, mu=1.0, c=1):
+    """ events per second of the M/M/c model, compared with the analytic mean waiting time (c=1) """
+    start = time.perf_counter()
+    sim, waiting, in_system = mmc_model(lam, mu, c, max_events=events)
+    elapsed = time.perf_counter() - start
+    print("M/M/{} (ρ={}): {} events in {:.2f}s = {:.0f} events/s".format(
+        c, lam / (c * mu), sim.events, elapsed, sim.events / elapsed))
+    print("waiting time:      {}".format(waiting.ci(0.05)))
+    print("number in system:  {:.4f} (CI of interval means: {})".format(in_system.mean(), in_system.estimator.ci(0.05)))
+    if c == 1:
+        rho = lam / mu
+        print("analytic (M/M/1):  waiting time {:.4f}, number in system {:.4f}".format(rho / (mu - lam), rho / (1 - rho)))
+
+
+def check_cancel_in_handler(n=100, cancelled=60):
+    """
+    a handler cancels most pending events (heap rebuild) and schedules a new one,
+    later handlers cancel events that already occurred (like timeouts)
+    """
+    sim = Simulator()
+    order = []
+    pending_counts = []
+    def record(event):
+        order.append(event.data)
+    def cancel_many(event):
+        order.append(event.data)
+        for pending in events[-cancelled:]:
+            sim.cancel(pending)
+        sim.schedule(0.5, record, "late")
+    def cancel_occurred(event):
+        order.append(event.data)
+        before = sim.event_list.n_cancelled
+        for occurred in events[:event.data]:
+            sim.cancel(occurred)
+        pending_counts.append((len(sim.event_list), sim.event_list.n_cancelled - before))
+    events = [sim.schedule(i + 1.0, record, i) for i in range(n)]
+    events[0].handler = cancel_many
+    events[20].handler = events[n - cancelled - 1].handler = cancel_occurred
+    sim.run()
+    expected = [0, "late"] + list(range(1, n - cancelled))
+    assert order == expected, order
+    # cancelling occurred events changes neither the pending count nor the cancelled count
+    assert pending_counts == [(n - cancelled - 21, 0), (0, 0)], pending_counts
+    assert sim.run() == 0 and len(sim.event_list) == 0 and sim.event_list.n_cancelled == 0
+    print("cancel in handler: ok ({} events)".format(sim.events))
+
+#uncomment to test
+#benchmark_mmc()
+#check_cancel_in_handler()
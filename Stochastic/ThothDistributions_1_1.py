@@ -7,9 +7,10 @@ Created on Fri Jan 31 15:24:13 2020
 TODO future: group into the following types
 - Discrete random variables
     - X∼Bernoulli(p)    ! DONE
-    - X∼Binomial(n,p)
-    - X∼Geometric(p)
+    - X∼Binomial(n,p)   ! DONE
+    - X∼Geometric(p)    ! DONE
     - X∼Poisson(λ)      ! DONE
+    - X∼Discrete(pmf)   ! DONE (alias table)
 - Continuous random variables
     - X∼Uniform(a,b)    ! DONE
     - X∼Exponential(λ)  ! DONE
@@ -18,20 +19,144 @@ TODO future: group into the following types
     - X∼SymTriange(a,b) ! DONE
     - X∼Ramp(a,off)     ! DONE
     - X∼WeibullDistribution(λ,α)     ! DONE
+    - X∼Empirical(data)              ! DONE
+    - X∼InverseTransform(ppf)        ! DONE (tabulated quantile function)
 """
 
 
 # local file
-import rngStream_n
+import ThothStreams_1_0
 import numpy as np
+import math
+import threading
+import time
+
+def _lgamma(x):
+    # math.lgamma elementwise (numpy has no log-gamma ufunc)
+    return np.frompyfunc(math.lgamma, 1, 1)(x).astype(float)
+
+
+def _new_stream(name, streams):
+    # streams = None:          hidden stream, next one of the package seed of the default backend
+    # streams = StreamFactory: next stream of the factory (see ThothStreams_1_0)
+    # streams = UniformPool:   next stream of the pool's factory
+    if streams is None:
+        return ThothStreams_1_0.new_stream(name)
+    return streams.next_stream(name)
+
+def _uniform(streams):
+    # U(0,1) source of derived distributions
+    if isinstance(streams, UniformPool):
+        return streams.uniform()
+    return UniformDistribution(streams=streams)
+
+def _loguniform(streams):
+    # LogU(0,1) source of derived distributions
+    if isinstance(streams, UniformPool):
+        return streams.loguniform()
+    return LogUniformDistribution(streams=streams)
+
 
 class Distribution:
-    def sketch(self, samples=100000, bins=100):
+    """
+    Base contract of all distributions:
+        X()   = one sample (scalar)
+        Xn(n) = n independent samples as numpy array (same distribution as X())
+    
+    Subclasses should override Xn with a vectorized implementation, the 
+    fallback below only loops over X().
+    
+    All constructors take an optional streams=StreamFactory(...) (ThothStreams_1_0),
+    which controls the RngStream(s) the distribution draws from, or a 
+    streams=UniformPool(...) to share uniforms between many distributions.
+    """
+    def X(self):
+        raise NotImplementedError("{} does not implement X()".format(type(self).__name__))
+    
+    def Xn(self, n):
+        return np.array([self.X() for _ in range(n)])
+    
+    def ppf(self, u):
+        """
+        inverse cdf (quantile function) on arrays, 
+        only available for distributions with a closed form
+        """
+        raise NotImplementedError("{} has no closed form inverse cdf".format(type(self).__name__))
+    
+    def pdf(self, x):
+        """
+        density (continuous) or pmf (discrete) on arrays, 
+        only available for distributions with a closed form
+        """
+        raise NotImplementedError("{} has no closed form pdf".format(type(self).__name__))
+    
+    def histogram(self, samples=100000, bins=100, batch_size=2**16, range=None):
+        """
+        Density histogram of `samples` draws, drawn and counted batch by batch 
+        (memory O(batch_size + bins), no plotting).
+        
+        range = (low, high) of the bins, None = taken from a pilot batch 
+                (0.05% and 99.95% quantile, widened by 5% but not beyond 
+                the smallest/largest pilot sample).
+                Samples outside of the range are not counted, so the density 
+                integrates to the probability mass inside the range.
+        Integer valued distributions get one bin per value, unless the range 
+        holds more than bins values (then bins equal width bins are used).
+        
+        returns (density, bin_edges) as in np.histogram
+        """
+        batch = self.Xn(min(batch_size, samples))
+        discrete = np.issubdtype(batch.dtype, np.integer)
+        if range is None:
+            if discrete:
+                range = (batch.min(), batch.max())
+            else:
+                low, high = np.quantile(batch, [0.0005, 0.9995])
+                pad = 0.05 * (high - low) if high > low else 0.5
+                range = (max(low - pad, batch.min()), min(high + pad, batch.max()))
+        if discrete:
+            low, high = int(np.floor(range[0])), int(np.ceil(range[1]))
+            if high - low + 1 > bins:
+                # too many values for one bin each, equal width bins around the values
+                discrete = False
+                range = (low - 0.5, high + 0.5)
+        if discrete:
+            edges = np.arange(low, high + 2) - 0.5
+        else:
+            edges = np.linspace(range[0], range[1], bins + 1)
+        counts = np.zeros(edges.size - 1, dtype=np.int64)
+        drawn = 0
+        while True:
+            drawn += batch.size
+            if discrete:
+                batch = batch[(batch >= low) & (batch <= high)] - low
+                counts += np.bincount(batch, minlength=counts.size)
+            else:
+                counts += np.histogram(batch, bins=bins, range=range)[0]
+            if drawn == samples:
+                break
+            batch = self.Xn(min(batch_size, samples - drawn))
+        return counts / (samples * np.diff(edges)), edges
+    
+    def sketch(self, samples=100000, bins=100, batch_size=2**16, range=None, pdf=False, show=True):
+        """
+        plots histogram(...), pdf=True overlays the analytic pdf
+        returns (density, bin_edges)
+        """
+        density, edges = self.histogram(samples, bins=bins, batch_size=batch_size, range=range)
+        
         import matplotlib.pyplot as plt
         
-        plt.hist([self.X() for _ in range(samples)], bins=bins, density=True)
+        plt.hist(edges[:-1], bins=edges, weights=density)
+        if pdf:
+            x = np.linspace(edges[0], edges[-1], 1000)
+            if np.all(np.diff(edges) == 1):
+                x = (edges[:-1] + 0.5).astype(int)
+            plt.plot(x, self.pdf(x), 'r.-' if x.size < 1000 else 'r-')
         plt.title("f(x) for " + str(self))
-        plt.show()
+        if show:
+            plt.show()
+        return density, edges
 
 #------------------------------------------------------------------------------------------------------ 
         
@@ -48,9 +173,9 @@ class BernoulliDistribution(Distribution):
     p(X = 1) = p
     p(X = 0) = 1-p
     """
-    def __init__(self, p=0.5):
+    def __init__(self, p=0.5, streams=None):
         self.p = p
-        self.unigen = UniformDistribution()  
+        self.unigen = _uniform(streams)  
     
     def __str__(self):
         return "X∼Bernoulli({})".format(self.p)
@@ -59,21 +184,51 @@ class BernoulliDistribution(Distribution):
     def X(self):
         return 1 if self.unigen.X() < self.p else 0
     
+    def Xn(self, n):
+        return (self.unigen.Xn(n) < self.p).astype(int)
+    
+    def ppf(self, u):
+        return (u > 1 - self.p).astype(int)
+    
+    def pdf(self, x):
+        return np.where(x == 1, self.p, np.where(x == 0, 1 - self.p, 0.0))
+    
 class PoissonDistribution(Distribution):
     """
     Returns a number of events happening in a fixed time interval 
     (each event has Exp. distr. with rate λ)
     X ∈ {0,1,2,...}
+    
+    λ <  PTRS_MIN_LAM: knuth's multiplicative method, O(λ) uniforms per sample
+    λ >= PTRS_MIN_LAM: transformed rejection with squeeze (PTRS, Hörmann 1993), 
+                       O(1) expected uniforms per sample
     """
-    def __init__(self, lam):
+    PTRS_MIN_LAM = 10
+    
+    def __init__(self, lam, streams=None):
         self.lam = lam
-        self.unigen = UniformDistribution()  
+        self.unigen = _uniform(streams)  
+        if lam >= PoissonDistribution.PTRS_MIN_LAM:
+            self.__init_ptrs()
     
     def __str__(self):
         return "X∼Poisson({})".format(self.lam)
+    
+    def pdf(self, x):
+        x = np.asarray(x)
+        return np.where(x >= 0, np.exp(x * math.log(self.lam) - self.lam - _lgamma(np.maximum(x, 0) + 1)), 0.0)
+    
+    def __init_ptrs(self):
+        slam = self.lam ** 0.5
+        self.log_lam = math.log(self.lam)
+        self.b = 0.931 + 2.53 * slam
+        self.a = -0.059 + 0.02483 * self.b
+        self.log_inv_alpha = math.log(1.1239 + 1.1328 / (self.b - 3.4))
+        self.v_r = 0.9277 - 3.6224 / (self.b - 2)
         
     def X(self):
-        #TODO: Implement more efficient method
+        if self.lam >= PoissonDistribution.PTRS_MIN_LAM:
+            return self.__ptrs()
         #knuth' method:
         L = np.e ** -self.lam
         k = 0
@@ -83,6 +238,278 @@ class PoissonDistribution(Distribution):
             p *= self.unigen.X()
         return k
     
+    def __ptrs(self):
+        while True:
+            U = self.unigen.X() - 0.5
+            V = self.unigen.X()
+            us = 0.5 - abs(U)
+            k = math.floor((2 * self.a / us + self.b) * U + self.lam + 0.43)
+            # squeeze: accept without evaluating the pmf
+            if us >= 0.07 and V <= self.v_r:
+                return k
+            if k < 0 or (us < 0.013 and V > us):
+                continue
+            if (math.log(V) + self.log_inv_alpha - math.log(self.a / (us * us) + self.b) 
+                    <= -self.lam + k * self.log_lam - math.lgamma(k + 1)):
+                return k
+    
+    def __ptrs_n(self, n):
+        # same rejection as __ptrs, but on blocks of candidates
+        samples = np.empty(n, dtype=int)
+        filled = 0
+        while filled < n:
+            m = int(1.15 * (n - filled)) + 16  # acceptance rate is > 0.9
+            U = self.unigen.Xn(m) - 0.5
+            V = self.unigen.Xn(m)
+            us = 0.5 - np.abs(U)
+            k = np.floor((2 * self.a / us + self.b) * U + self.lam + 0.43)
+            accept = (us >= 0.07) & (V <= self.v_r)
+            test = np.flatnonzero(~accept & (k >= 0) & ((us >= 0.013) | (V <= us)))
+            lhs = np.log(V[test]) + self.log_inv_alpha - np.log(self.a / (us[test] ** 2) + self.b)
+            rhs = -self.lam + k[test] * self.log_lam - _lgamma(k[test] + 1)
+            accept[test[lhs <= rhs]] = True
+            accepted = k[accept][:n - filled]
+            samples[filled:filled + accepted.size] = accepted
+            filled += accepted.size
+        return samples
+    
+    def Xn(self, n):
+        if self.lam >= PoissonDistribution.PTRS_MIN_LAM:
+            return self.__ptrs_n(n)
+        # knuth's method on arrays: multiply all still running products at once
+        L = np.e ** -self.lam
+        k = np.zeros(n, dtype=int)
+        p = self.unigen.Xn(n)
+        running = np.flatnonzero(p > L)
+        while running.size > 0:
+            k[running] += 1
+            p[running] *= self.unigen.Xn(running.size)
+            running = running[p[running] > L]
+        return k
+    
+
+class BinomialDistribution(Distribution):
+    """
+    Returns the number of successes in n independent Bernoulli(p) trials
+    X ∈ {0,1,...,n}
+    
+    n*min(p,1-p) <  BTRS_MIN_MEAN: sequential inversion
+    n*min(p,1-p) >= BTRS_MIN_MEAN: transformed rejection with squeeze (BTRS, Hörmann 1993), 
+                                   O(1) expected uniforms per sample
+    p > 0.5 is sampled as n - Binomial(n, 1-p)
+    """
+    BTRS_MIN_MEAN = 10
+    
+    def __init__(self, n, p=0.5, streams=None):
+        self.n = n
+        self.p = p
+        self.flipped = p > 0.5
+        self.p_ = 1 - p if self.flipped else p
+        self.q_ = 1 - self.p_
+        self.unigen = _uniform(streams)  
+        self.use_btrs = n * self.p_ >= BinomialDistribution.BTRS_MIN_MEAN
+        if self.use_btrs:
+            self.__init_btrs()
+        else:
+            self.__init_inversion()
+    
+    def __str__(self):
+        return "X∼Binomial({},{})".format(self.n, self.p)
+    
+    def pdf(self, x):
+        x = np.asarray(x)
+        k = np.clip(x, 0, self.n)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_pmf = (math.lgamma(self.n + 1) - _lgamma(k + 1) - _lgamma(self.n - k + 1)
+                       + np.nan_to_num(k * np.log(self.p)) + np.nan_to_num((self.n - k) * np.log1p(-self.p)))
+        return np.where((x >= 0) & (x <= self.n), np.exp(log_pmf), 0.0)
+    
+    def __init_inversion(self):
+        self.s = self.p_ / self.q_
+        self.a_inv = (self.n + 1) * self.s
+        self.r_0 = self.q_ ** self.n
+    
+    def __init_btrs(self):
+        n, p = self.n, self.p_
+        spq = (n * p * self.q_) ** 0.5
+        self.b = 1.15 + 2.53 * spq
+        self.a = -0.0873 + 0.0248 * self.b + 0.01 * p
+        self.c = n * p + 0.5
+        self.alpha = (2.83 + 5.1 / self.b) * spq
+        self.v_r = 0.92 - 4.2 / self.b
+        self.m = math.floor((n + 1) * p)
+        self.h = math.lgamma(self.m + 1) + math.lgamma(n - self.m + 1)
+        self.log_pq = math.log(p / self.q_)
+    
+    def __flip(self, k):
+        return self.n - k if self.flipped else k
+        
+    def X(self):
+        k = self.__btrs() if self.use_btrs else self.__inversion()
+        return self.__flip(k)
+    
+    def Xn(self, n):
+        k = self.__btrs_n(n) if self.use_btrs else self.__inversion_n(n)
+        return self.__flip(k)
+    
+    def __inversion(self):
+        while True:
+            u = self.unigen.X()
+            r = self.r_0
+            k = 0
+            while u > r and k <= self.n:
+                u -= r
+                k += 1
+                r *= self.a_inv / k - self.s
+            if k <= self.n:  # k > n only through rounding, draw again
+                return k
+    
+    def __inversion_n(self, n):
+        samples = np.zeros(n, dtype=int)
+        u = self.unigen.Xn(n)
+        r = np.full(n, self.r_0)
+        running = np.flatnonzero(u > r)
+        while running.size > 0:
+            u[running] -= r[running]
+            samples[running] += 1
+            r[running] *= self.a_inv / samples[running] - self.s
+            overflow = running[samples[running] > self.n]
+            if overflow.size > 0:
+                # k > n only through rounding, draw again
+                samples[overflow] = 0
+                u[overflow] = self.unigen.Xn(overflow.size)
+                r[overflow] = self.r_0
+            running = running[u[running] > r[running]]
+        return samples
+    
+    def __btrs(self):
+        while True:
+            u = self.unigen.X() - 0.5
+            v = self.unigen.X()
+            us = 0.5 - abs(u)
+            k = math.floor((2 * self.a / us + self.b) * u + self.c)
+            if k < 0 or k > self.n:
+                continue
+            # squeeze: accept without evaluating the pmf
+            if us >= 0.07 and v <= self.v_r:
+                return k
+            v = math.log(v * self.alpha / (self.a / (us * us) + self.b))
+            if v <= self.h - math.lgamma(k + 1) - math.lgamma(self.n - k + 1) + (k - self.m) * self.log_pq:
+                return k
+    
+    def __btrs_n(self, n):
+        # same rejection as __btrs, but on blocks of candidates
+        samples = np.empty(n, dtype=int)
+        filled = 0
+        while filled < n:
+            m = int(1.2 * (n - filled)) + 16  # acceptance rate is > 0.85
+            u = self.unigen.Xn(m) - 0.5
+            v = self.unigen.Xn(m)
+            us = 0.5 - np.abs(u)
+            k = np.floor((2 * self.a / us + self.b) * u + self.c)
+            in_range = (k >= 0) & (k <= self.n)
+            accept = in_range & (us >= 0.07) & (v <= self.v_r)
+            test = np.flatnonzero(in_range & ~accept)
+            kt = k[test]
+            lhs = np.log(v[test] * self.alpha / (self.a / (us[test] ** 2) + self.b))
+            rhs = self.h - _lgamma(kt + 1) - _lgamma(self.n - kt + 1) + (kt - self.m) * self.log_pq
+            accept[test[lhs <= rhs]] = True
+            accepted = k[accept][:n - filled]
+            samples[filled:filled + accepted.size] = accepted
+            filled += accepted.size
+        return samples
+    
+
+class GeometricDistribution(Distribution):
+    """
+    Returns the number of Bernoulli(p) trials up to (and including) the first success
+    X ∈ {1,2,3,...}
+    inverse transform: X = floor(log(U) / log(1-p)) + 1
+    """
+    def __init__(self, p, streams=None):
+        self.p = p
+        self.log_q = math.log1p(-p) if p < 1 else -math.inf
+        self.logunigen = _loguniform(streams)  
+    
+    def __str__(self):
+        return "X∼Geometric({})".format(self.p)
+        
+    def X(self):
+        return math.floor(self.logunigen.X() / self.log_q) + 1
+    
+    def Xn(self, n):
+        return np.floor(self.logunigen.Xn(n) / self.log_q).astype(int) + 1
+    
+    def ppf(self, u):
+        return np.floor(np.log1p(-u) / self.log_q).astype(int) + 1
+    
+    def pdf(self, x):
+        x = np.asarray(x)
+        return np.where(x >= 1, self.p * np.power(1 - self.p, np.maximum(x, 1) - 1), 0.0)
+    
+
+class DiscreteDistribution(Distribution):
+    """
+    Arbitrary finite pmf, sampled in O(1) with Walker's alias method (Vose's construction)
+    X ∈ values
+    p(X = values[i]) = probabilities[i]  (normalized if they do not sum up to 1)
+    
+    example:
+        DiscreteDistribution([1, 2, 5], [0.2, 0.5, 0.3])
+    """
+    def __init__(self, values, probabilities, streams=None):
+        self.values = np.asarray(values)
+        probabilities = np.asarray(probabilities, dtype=float)
+        if self.values.shape != probabilities.shape or self.values.ndim != 1:
+            raise ValueError("values and probabilities have to be 1d sequences of equal length")
+        if np.any(probabilities < 0) or probabilities.sum() <= 0:
+            raise ValueError("probabilities have to be non-negative with a positive sum")
+        self.p = probabilities / probabilities.sum()
+        self.k = self.p.size
+        self.prob, self.alias = DiscreteDistribution.alias_table(self.p)
+        self.unigen = _uniform(streams)  
+    
+    def __str__(self):
+        return "X∼Discrete(k={})".format(self.k)
+    
+    @staticmethod
+    def alias_table(p):
+        """
+        column i is taken with probability prob[i], otherwise its alias[i]
+        """
+        k = p.size
+        prob = np.ones(k)
+        alias = np.arange(k)
+        scaled = (p * k).tolist()
+        small = [i for i in range(k) if scaled[i] < 1.0]
+        large = [i for i in range(k) if scaled[i] >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # what remains is 1 up to rounding errors
+        return prob, alias
+        
+    def X(self):
+        v = self.unigen.X() * self.k
+        i = int(v)
+        return self.values[i if v - i < self.prob[i] else self.alias[i]]
+    
+    def Xn(self, n):
+        v = self.unigen.Xn(n) * self.k
+        i = v.astype(int)
+        return self.values[np.where(v - i < self.prob[i], i, self.alias[i])]
+    
+    def ppf(self, u):
+        cdf = np.cumsum(self.p)
+        return self.values[np.minimum(np.searchsorted(cdf, u, side='right'), self.k - 1)]
+    
+    def pdf(self, x):
+        x = np.asarray(x)
+        return (x[..., None] == self.values).astype(float) @ self.p
+    
 
 #------------------------------------------------------------------------------------------------------ 
         
@@ -95,73 +522,366 @@ class PoissonDistribution(Distribution):
 
 
 
-class UniformDistribution(Distribution):
-    def __init__(self, name="UniGenDist01", lower=0.0, upper=1.0, cache_size=10000):
-        self.range = upper - lower
-        self.upper = upper
-        self.lower = lower
-        self.unigen = rngStream_n.RngStream(name)
-        self.cache_size = cache_size
-        self.reload_cache()
+class UniformBlockCache:
+    """
+    Fills blocks of uniforms from a stream into preallocated buffers 
+    and applies the transform of the owning distribution in place
+    (MRG32k3a.fill writes into the buffer directly, RngStream.nRandU01 via a list).
+    
+    - adaptive:  the block size is doubled whenever a block was consumed in less 
+                 than TARGET_REFILL_SECONDS, bounded by max_bytes (all buffers)
+    - prefetch:  the next block is filled on a background thread while the 
+                 current one is consumed (double buffering)
+    
+    Values are always handed out in stream order, so neither the block size nor 
+    prefetching changes the sequence of samples.
+    
+    counters:
+        hits    = values served from cached blocks
+        refills = blocks handed out
+        direct  = values drawn past the cache by batches
+    """
+    TARGET_REFILL_SECONDS = 0.01
+    
+    def __init__(self, unigen, transform, block_size=10000, max_bytes=2**20, adaptive=True, prefetch=False):
+        self.unigen = unigen
+        self.direct_fill = hasattr(unigen, "fill")
+        self.transform = transform
+        self.adaptive = adaptive
+        self.prefetch = prefetch
+        self.n_buffers = 2 if prefetch else 1
+        self.max_block_size = max(max_bytes // (8 * self.n_buffers), 1)
+        self.block_size = min(block_size, self.max_block_size)
+        self.buffers = [np.empty(self.block_size) for _ in range(self.n_buffers)]
+        self.hits = 0
+        self.refills = 0
+        self.direct = 0
+        self.spare = self.n_buffers - 1  # buffer to fill next
+        self.spare_start = 0             # part of the (filled) spare already handed out
+        self.pending = None              # thread filling the spare
+        self.last_refill = None          # time of the last refill (None until the first one)
+        if prefetch:
+            self.__start_prefetch()
+    
+    def __str__(self):
+        return "<UniformBlockCache block_size:{}, hits:{}, refills:{}, direct:{}>".format(
+                self.block_size, self.hits, self.refills, self.direct)
+    
+    def nbytes(self):
+        return sum(buf.nbytes for buf in self.buffers)
     
+    def __draw_uniforms(self, buf):
+        if self.direct_fill:
+            self.unigen.fill(buf)
+        else:
+            buf[:] = self.unigen.nRandU01(buf.size)
+    
+    def __fill(self, buf):
+        self.__draw_uniforms(buf)
+        self.transform(buf)
+    
+    def __spare_buffer(self):
+        # (re)allocation only happens after the block size changed
+        if self.buffers[self.spare].size != self.block_size:
+            self.buffers[self.spare] = np.empty(self.block_size)
+        return self.buffers[self.spare]
+    
+    def __start_prefetch(self):
+        self.pending = threading.Thread(target=self.__fill, args=(self.__spare_buffer(),), daemon=True)
+        self.pending.start()
+    
+    def __wait(self):
+        if self.pending is not None:
+            self.pending.join()
+            self.pending = None
+    
+    def __adapt(self):
+        # measured between two refills, the first fill (in the constructor) only starts the clock
+        now = time.perf_counter()
+        if self.last_refill is None:
+            self.last_refill = now
+            return
+        consumed_fast = now - self.last_refill < UniformBlockCache.TARGET_REFILL_SECONDS
+        self.last_refill = now
+        if self.adaptive and consumed_fast and self.block_size < self.max_block_size:
+            self.block_size = min(2 * self.block_size, self.max_block_size)
+    
+    def next_block(self):
+        self.refills += 1
+        self.__adapt()
+        if not self.prefetch:
+            block = self.__spare_buffer()
+            self.__fill(block)
+            return block
+        self.__wait()
+        block = self.buffers[self.spare]
+        if self.spare_start == block.size:
+            # the prefetched block went to a batch, draw a new one
+            self.__fill(block)
+            self.spare_start = 0
+        block = block[self.spare_start:]
+        self.spare_start = 0
+        self.spare ^= 1
+        self.__start_prefetch()
+        return block
+    
+    def draw(self, n, out):
+        """ writes the next n values (after the current block) into out """
+        k = 0
+        if self.prefetch:
+            self.__wait()
+            spare = self.buffers[self.spare]
+            k = min(n, spare.size - self.spare_start)
+            out[:k] = spare[self.spare_start:self.spare_start + k]
+            self.spare_start += k
+            self.hits += k
+        if k < n:
+            self.__fill(out[k:])
+            self.direct += n - k
+        return out
+
+
+class _BlockCachedDistribution(Distribution):
+    """
+    X()/Xn(n) on top of a UniformBlockCache, subclasses define transform(buf)
+    """
+    def _init_cache(self, cache_size, max_cache_bytes, adaptive, prefetch):
+        self.engine = UniformBlockCache(self.unigen, self.transform, block_size=cache_size, 
+                                        max_bytes=max_cache_bytes, adaptive=adaptive, prefetch=prefetch)
+        self.reload_cache()
+        
     def reload_cache(self):
-        self.cache = (np.array(self.unigen.nRandU01(self.cache_size)) * self.range)+ self.lower
+        self.cache = self.engine.next_block()
+        self.cache_size = self.cache.size
         self.i = 0
     
-    def __str__(self):
-        return "X~U({},{})".format(self.lower, self.upper)
+    def cache_stats(self):
+        return {"hits": self.engine.hits + self.i, 
+                "refills": self.engine.refills, 
+                "direct": self.engine.direct,
+                "block_size": self.engine.block_size, 
+                "bytes": self.engine.nbytes()}
         
     def Xn(self, n):
-        return (np.array(self.unigen.nRandU01(self.cache_size)) * self.range)+ self.lower
+        # rest of the current block first, so X() and Xn() keep stream order
+        rest = self.cache_size - self.i
+        if n < rest:
+            samples = self.cache[self.i:self.i + n].copy()
+            self.i += n
+            return samples
+        samples = np.empty(n)
+        samples[:rest] = self.cache[self.i:]
+        self.engine.hits += self.cache_size
+        self.engine.draw(n - rest, samples[rest:])
+        self.reload_cache()
+        return samples
         
     def X(self):
         u = self.cache[self.i] 
         self.i += 1
         if self.i == self.cache_size:
+            self.engine.hits += self.cache_size
             self.reload_cache()
         return u
     
-class LogUniformDistribution(Distribution):
-    def __init__(self, name="LogUniGenDist01", cache_size=10000):
-        self.unigen = rngStream_n.RngStream(name)
-        self.cache_size = cache_size
-        self.reload_cache()
+
+class UniformDistribution(_BlockCachedDistribution):
+    """
+    antithetic = emit 1-u instead of u (default: taken from the StreamFactory)
+    """
+    def __init__(self, name="UniGenDist01", lower=0.0, upper=1.0, cache_size=10000, streams=None,
+                 max_cache_bytes=2**20, adaptive=True, prefetch=False, antithetic=False):
+        self.range = upper - lower
+        self.upper = upper
+        self.lower = lower
+        self.antithetic = antithetic or getattr(streams, "antithetic", False)
+        self.unigen = _new_stream(name, streams)
+        self._init_cache(cache_size, max_cache_bytes, adaptive, prefetch)
     
-    def reload_cache(self):
-        self.cache = np.log(self.unigen.nRandU01(self.cache_size))
-        self.i = 0
+    def ppf(self, u):
+        return self.lower + self.range * u
+    
+    def pdf(self, x):
+        return np.where((x >= self.lower) & (x <= self.upper), 1 / self.range, 0.0)
+    
+    def transform(self, buf):
+        if self.antithetic:
+            np.subtract(1.0, buf, out=buf)
+        if self.range != 1.0:
+            np.multiply(buf, self.range, out=buf)
+        if self.lower != 0.0:
+            np.add(buf, self.lower, out=buf)
+    
+    def __str__(self):
+        return "X~U({},{})".format(self.lower, self.upper)
+    
+    
+class LogUniformDistribution(_BlockCachedDistribution):
+    """
+    antithetic = emit log(1-u) instead of log(u) (default: taken from the StreamFactory)
+    """
+    def __init__(self, name="LogUniGenDist01", cache_size=10000, streams=None,
+                 max_cache_bytes=2**20, adaptive=True, prefetch=False, antithetic=False):
+        self.antithetic = antithetic or getattr(streams, "antithetic", False)
+        self.unigen = _new_stream(name, streams)
+        self._init_cache(cache_size, max_cache_bytes, adaptive, prefetch)
+    
+    def transform(self, buf):
+        if self.antithetic:
+            np.negative(buf, out=buf)
+            np.log1p(buf, out=buf)
+        else:
+            np.log(buf, out=buf)
     
     def __str__(self):
         return "X~LogU(0,1)".format()
-        
-    def Xn(self, n):
-        return np.log(self.unigen.nRandU01(self.cache_size)) 
-        
-    def X(self):
-        logu = self.cache[self.i] 
-        self.i += 1
-        if self.i == self.cache_size:
-            self.reload_cache()
-        return logu
     
 
+class UniformPool:
+    """
+    Opt-in shared source of uniforms, pass it as streams=pool to any distribution.
+    
+    shared    (dedicated=False): 
+        all consumers draw from one U(0,1) and one LogU(0,1) block cache.
+        + memory and startup are O(1) in the number of distributions 
+          (2 streams, 2 caches instead of up to 2 per distribution)
+        + every draw hits a hot cache, refills are amortized over all consumers
+        - the samples of a consumer depend on the interleaving of the calls of 
+          all consumers, i.e. a run is only reproducible as a whole
+    dedicated (dedicated=True): 
+        every consumer gets its own stream (of the StreamFactory, if given) with a 
+        small cache of dedicated_cache_size values.
+        + per consumer substream semantics (reproducible, usable for common random numbers)
+        - memory O(consumers * dedicated_cache_size), one stream per consumer
+          and more frequent (smaller) refills
+    
+    example:
+        pool = UniformPool(StreamFactory())
+        servers = [NormalDistribution(1, 0.1, streams=pool) for _ in range(10000)]
+    """
+    def __init__(self, streams=None, cache_size=10000, dedicated=False, dedicated_cache_size=64):
+        self.streams = streams
+        self.antithetic = getattr(streams, "antithetic", False)
+        self.dedicated = dedicated
+        self.dedicated_cache_size = dedicated_cache_size
+        if not dedicated:
+            self.unigen = UniformDistribution("UniformPool", cache_size=cache_size, streams=streams)
+            self.logunigen = LogUniformDistribution("LogUniformPool", cache_size=cache_size, streams=streams)
+    
+    def __str__(self):
+        return "<UniformPool {}>".format("dedicated" if self.dedicated else "shared")
+    
+    def next_stream(self, name):
+        return _new_stream(name, self.streams)
+    
+    def uniform(self):
+        if self.dedicated:
+            # fixed cache size (not adaptive), keeps the memory O(consumers * dedicated_cache_size)
+            return UniformDistribution(cache_size=self.dedicated_cache_size, streams=self.streams, adaptive=False)
+        return self.unigen
+    
+    def loguniform(self):
+        if self.dedicated:
+            return LogUniformDistribution(cache_size=self.dedicated_cache_size, streams=self.streams, adaptive=False)
+        return self.logunigen
+    
+
+#------------------------------------   Ziggurat tables ------------------------------------------------
+#
+# Marsaglia & Tsang (2000), floating point layout of Doornik (2005):
+#   C layers of equal area V, x[0] = V/f(R) (base layer incl. tail), x[1] = R, x[C] = 0
+#   ratio[i] = x[i+1]/x[i]   (fraction of layer i that lies completely under f)
+#
+# One U(0,1) drives a sample: the integer part of C*U selects the layer,
+# the fractional part is the position within the layer.
+
+def _ziggurat_tables(C, R, V, f, f_inv):
+    x = np.empty(C + 1)
+    x[0] = V / f(R)
+    x[1] = R
+    x[C] = 0.0
+    for i in range(2, C):
+        x[i] = f_inv(V / x[i - 1] + f(x[i - 1]))
+    return x, x[1:] / x[:-1]
+
+ZIG_NORM_C = 128
+ZIG_NORM_R = 3.442619855899
+ZIG_NORM_V = 9.91256303526217e-3
+ZIG_NORM_X, ZIG_NORM_RATIO = _ziggurat_tables(ZIG_NORM_C, ZIG_NORM_R, ZIG_NORM_V, 
+                                              lambda x: math.exp(-0.5 * x * x), 
+                                              lambda y: math.sqrt(-2 * math.log(y)))
+ZIG_EXP_C = 256
+ZIG_EXP_R = 7.69711747013104972
+ZIG_EXP_V = 3.949659822581572e-3
+ZIG_EXP_X, ZIG_EXP_RATIO = _ziggurat_tables(ZIG_EXP_C, ZIG_EXP_R, ZIG_EXP_V, 
+                                            lambda x: math.exp(-x), 
+                                            lambda y: -math.log(y))
+
+# python lists for the scalar paths (indexing numpy arrays with ints is slow)
+_ZIG_NORM_X, _ZIG_NORM_RATIO = ZIG_NORM_X.tolist(), ZIG_NORM_RATIO.tolist()
+_ZIG_EXP_X, _ZIG_EXP_RATIO = ZIG_EXP_X.tolist(), ZIG_EXP_RATIO.tolist()
+
+def _ziggurat_normal_tail_n(logunigen, n):
+    # |X| conditioned on |X| > R (Marsaglia's tail method)
+    tail = np.empty(n)
+    filled = 0
+    while filled < n:
+        m = 2 * (n - filled) + 8
+        x = logunigen.Xn(m) / ZIG_NORM_R
+        accepted = (ZIG_NORM_R - x)[-2 * logunigen.Xn(m) >= x * x][:n - filled]
+        tail[filled:filled + accepted.size] = accepted
+        filled += accepted.size
+    return tail
+
 class NormalDistribution(Distribution):
-    def __init__(self,mean=0, var=1):
+    """
+    method = "box-muller" (default) or 
+             "ziggurat"   (Marsaglia & Tsang, one uniform for ~99% of the samples)
+    
+    the method only applies to X(), Xn() always uses the vectorized box-muller
+    (a numpy ziggurat pays for the table lookups and the rejection masks, see benchmark_ziggurat())
+    """
+    METHODS = ("box-muller", "ziggurat")
+    
+    def __init__(self,mean=0, var=1, streams=None, method="box-muller"):
+        if method not in NormalDistribution.METHODS:
+            raise ValueError("No such method available: {}. Choose one of {}".format(method, NormalDistribution.METHODS))
         self.random_values = []
         self.var = var
         self.std = var**0.5
         self.mean = mean
-        self.unigen = UniformDistribution() 
-        self.logunigen = LogUniformDistribution()        
+        self.method = method
+        self.unigen = _uniform(streams) 
+        self.logunigen = _loguniform(streams)        
         
     def __str__(self):
         return "X~N({},{})".format(self.mean, self.var)
+    
+    def pdf(self, x):
+        return np.exp(-0.5 * (x - self.mean) ** 2 / self.var) / (2 * np.pi * self.var) ** 0.5
 
     def X(self):
+        if self.method == "ziggurat":
+            return self.__ziggurat() * self.std + self.mean
         if len(self.random_values) == 0:
             self.__generate_new_random_variables()
         return self.random_values.pop()
 
+    def __ziggurat(self):
+        while True:
+            v = float(self.unigen.X()) * ZIG_NORM_C
+            i = int(v)
+            u = 2 * (v - i) - 1
+            if abs(u) < _ZIG_NORM_RATIO[i]:
+                return u * _ZIG_NORM_X[i]
+            if i == 0:
+                return math.copysign(_ziggurat_normal_tail_n(self.logunigen, 1)[0], u)
+            x = u * _ZIG_NORM_X[i]
+            f0 = math.exp(-0.5 * (_ZIG_NORM_X[i] ** 2 - x * x))
+            f1 = math.exp(-0.5 * (_ZIG_NORM_X[i + 1] ** 2 - x * x))
+            if f1 + self.unigen.X() * (f0 - f1) < 1.0:
+                return x
+
     def __generate_new_random_variables(self):
         log_U_1 = self.logunigen.X()
         U_2 = self.unigen.X()
@@ -177,34 +897,91 @@ class NormalDistribution(Distribution):
         self.random_values.append(X_1)
         self.random_values.append(X_2)
         
+    def Xn(self, n):
+        # box-muller on arrays: ceil(n/2) pairs, cos-half and sin-half
+        pairs = (n + 1) // 2
+        r = np.sqrt(-2 * self.logunigen.Xn(pairs))
+        phi = 2 * np.pi * self.unigen.Xn(pairs)
+        X = np.concatenate((r * np.cos(phi), r * np.sin(phi)))[:n]
+        return X * self.std + self.mean
+        
 
 class ExponentialDistribution(Distribution):
-    def __init__(self,lam):
+    """
+    method = "inversion" (default, one log per sample) or 
+             "ziggurat"  (Marsaglia & Tsang, no log for ~99% of the samples)
+    
+    the method only applies to X(), Xn() always uses the inversion: its logs are 
+    computed blockwise in the LogUniformDistribution cache, which is hard to beat 
+    in numpy; see benchmark_ziggurat()
+    """
+    METHODS = ("inversion", "ziggurat")
+    
+    def __init__(self,lam, streams=None, method="inversion"):
+        if method not in ExponentialDistribution.METHODS:
+            raise ValueError("No such method available: {}. Choose one of {}".format(method, ExponentialDistribution.METHODS))
         self.lam = lam
         self.lam_inv = 1/lam
-        self.logunigen = LogUniformDistribution()        
+        self.method = method
+        self.logunigen = _loguniform(streams)        
+        if method == "ziggurat":
+            self.unigen = _uniform(streams)
         
     def __str__(self):
         return "X~Exp({})".format(self.lam)
 
     def X(self):
-       return -self.lam_inv * self.logunigen.X()
+        if self.method == "ziggurat":
+            return self.lam_inv * self.__ziggurat()
+        return -self.lam_inv * self.logunigen.X()
+    
+    def __ziggurat(self):
+        while True:
+            v = float(self.unigen.X()) * ZIG_EXP_C
+            i = int(v)
+            u = v - i
+            if u < _ZIG_EXP_RATIO[i]:
+                return u * _ZIG_EXP_X[i]
+            if i == 0:
+                return ZIG_EXP_R - self.logunigen.X()
+            x = u * _ZIG_EXP_X[i]
+            f0 = math.exp(x - _ZIG_EXP_X[i])
+            f1 = math.exp(x - _ZIG_EXP_X[i + 1])
+            if f1 + self.unigen.X() * (f0 - f1) < 1.0:
+                return x
+    
+    def Xn(self, n):
+        return -self.lam_inv * self.logunigen.Xn(n)
+    
+    def ppf(self, u):
+        return -self.lam_inv * np.log1p(-u)
+    
+    def pdf(self, x):
+        return np.where(x >= 0, self.lam * np.exp(-self.lam * np.maximum(x, 0)), 0.0)
 
 
 class KErlangDistribution(Distribution):
-    def __init__(self,lam,k):
+    def __init__(self,lam,k, streams=None):
         self.lam = lam
         self.k = k
-        self.expgen = ExponentialDistribution(lam)        
+        self.expgen = ExponentialDistribution(lam, streams=streams)        
         
     def __str__(self):
         return "X~{}-Erlang({})".format(self.k, self.lam)
+    
+    def pdf(self, x):
+        x = np.maximum(x, 0)
+        return np.where(x > 0, self.lam ** self.k * x ** (self.k - 1) * np.exp(-self.lam * x) / math.factorial(self.k - 1), 0.0)
 
     def X(self):
         x_sum = self.expgen.X()
         for _ in range(self.k-1):
             x_sum += self.expgen.X()
         return x_sum
+    
+    def Xn(self, n):
+        # row i holds the k exponential phases of sample i
+        return self.expgen.Xn(n * self.k).reshape(n, self.k).sum(axis=1)
 
 class SymmetricTriangleDistribution(Distribution):
 # f(x):          o 
@@ -218,17 +995,29 @@ class SymmetricTriangleDistribution(Distribution):
 #    |                       |
 #    lower                   upper
     
-    def __init__(self,lower, upper):
+    def __init__(self,lower, upper, streams=None):
         self.upper = upper
         self.lower = lower
         self.r = (upper - lower)/2
-        self.unigen = UniformDistribution()        
+        self.unigen = _uniform(streams)        
         
     def __str__(self):
         return "X~SymTriangle([{},{}])".format(self.lower, self.upper)
 
     def X(self):
        return self.r *(self.unigen.X() + self.unigen.X()) + self.lower
+    
+    def Xn(self, n):
+        return self.r * self.unigen.Xn(2 * n).reshape(n, 2).sum(axis=1) + self.lower
+    
+    def ppf(self, u):
+        lower_half = u <= 0.5
+        return np.where(lower_half, 
+                        self.lower + self.r * np.sqrt(2 * np.where(lower_half, u, 0.5)), 
+                        self.upper - self.r * np.sqrt(2 * np.where(lower_half, 0.5, 1 - u)))
+    
+    def pdf(self, x):
+        return np.maximum(self.r - np.abs(x - self.lower - self.r), 0) / self.r ** 2
    
   
 class RampDistribution(Distribution):
@@ -243,16 +1032,25 @@ class RampDistribution(Distribution):
 #    |                       
 #    offset                   
     
-    def __init__(self,a, offset=0):
+    def __init__(self,a, offset=0, streams=None):
         self.a = a
         self.offset = offset
-        self.unigen = UniformDistribution()        
+        self.unigen = _uniform(streams)        
         
     def __str__(self):
         return "X~Ramp({}, offset={})".format(self.a, self.offset)
 
     def X(self):
        return self.offset + (self.unigen.X() ** 0.5) * self.a
+    
+    def Xn(self, n):
+        return self.offset + np.sqrt(self.unigen.Xn(n)) * self.a
+    
+    def ppf(self, u):
+        return self.offset + np.sqrt(u) * self.a
+    
+    def pdf(self, x):
+        return np.where((x >= self.offset) & (x <= self.offset + self.a), 2 * (x - self.offset) / self.a ** 2, 0.0)
    
     
 class WeibullDistribution(Distribution):
@@ -260,11 +1058,11 @@ class WeibullDistribution(Distribution):
         λ = scale parameter
         α = shape parameter
     """
-    def __init__(self,lam, alpha):
+    def __init__(self,lam, alpha, streams=None):
         self.alpha = alpha
         self.lam = lam
         self.altha_root = 1/self.alpha
-        self.logunigen = LogUniformDistribution()        
+        self.logunigen = _loguniform(streams)        
         
     def __str__(self):
         return "X~Weibull(λ={}, α={})".format(self.lam, self.alpha)
@@ -272,6 +1070,110 @@ class WeibullDistribution(Distribution):
     def X(self):
        return np.power(- self.logunigen.X() , self.altha_root) / self.lam
     
+    def Xn(self, n):
+        return np.power(- self.logunigen.Xn(n) , self.altha_root) / self.lam
+    
+    def ppf(self, u):
+        return np.power(- np.log1p(-u) , self.altha_root) / self.lam
+    
+    def pdf(self, x):
+        lx = self.lam * np.maximum(x, 0)
+        with np.errstate(divide='ignore'):
+            return np.where(x > 0, self.alpha * self.lam * np.power(lx, self.alpha - 1) * np.exp(-np.power(lx, self.alpha)), 0.0)
+    
+
+class InverseTransformDistribution(Distribution):
+    """
+    Tabulates an arbitrary quantile function once and samples it by linear 
+    interpolation of the table (vectorized in Xn).
+    
+    ppf        = quantile function, has to accept numpy arrays
+    table_size = number of tabulated points in [tail_eps, 1-tail_eps]
+    tail_eps   = the table is cut off at the tail_eps and 1-tail_eps quantiles 
+                 (needed for unbounded distributions, where ppf(0) or ppf(1) is infinite)
+    
+    example:
+        InverseTransformDistribution(lambda u: np.tan(np.pi * (u - 0.5)), name="Cauchy")
+    """
+    def __init__(self, ppf, table_size=4097, tail_eps=1e-9, name="ppf", streams=None):
+        self.name = name
+        self.grid = np.linspace(0.0, 1.0, table_size)
+        self.grid[0], self.grid[-1] = tail_eps, 1.0 - tail_eps
+        self.table = np.asarray(ppf(self.grid), dtype=float)
+        if np.any(np.diff(self.table) < 0):
+            raise ValueError("ppf has to be monotonically non-decreasing")
+        self.unigen = _uniform(streams) 
+        
+    def __str__(self):
+        return "X~InverseTransform({})".format(self.name)
+    
+    def ppf(self, u):
+        return np.interp(u, self.grid, self.table)
+    
+    def X(self):
+        return float(np.interp(self.unigen.X(), self.grid, self.table))
+    
+    def Xn(self, n):
+        return np.interp(self.unigen.Xn(n), self.grid, self.table)
+    
+
+class EmpiricalDistribution(InverseTransformDistribution):
+    """
+    Piecewise linear inverse of the empirical cdf of data: 
+        the i-th smallest of the m data points is the i/(m-1) quantile, 
+        values in between are interpolated linearly (X ∈ [min(data), max(data)])
+    table_size = None: every data point is a table entry, 
+                 otherwise the table holds table_size equidistant quantiles
+    
+    example:
+        latencies = np.array(CsvLoader.read_plain_ith_column('Data/trace.csv', 3), dtype=float)
+        EmpiricalDistribution(latencies)
+    """
+    def __init__(self, data, table_size=None, streams=None):
+        data = np.sort(np.asarray(data, dtype=float).ravel())
+        if data.size < 2:
+            raise ValueError("An empirical distribution needs at least 2 data points")
+        self.n_data = data.size
+        self.grid = np.linspace(0.0, 1.0, data.size)
+        self.table = data
+        if table_size is not None:
+            grid = np.linspace(0.0, 1.0, table_size)
+            self.grid, self.table = grid, np.interp(grid, self.grid, self.table)
+        self.unigen = _uniform(streams)
+    
+    def __str__(self):
+        return "X~Empirical(n={})".format(self.n_data)
+    
+
+#------------------------------------------------------------------------------------------------------ 
+        
+#------------------------------------   Variance reduction -------------------------------------------- 
+
+#------------------------------------------------------------------------------------------------------ 
+#
+# antithetic variates:    UniformDistribution(antithetic=True) / StreamFactory.antithetic_twin() 
+#                         mirror all uniforms (u -> 1-u). The inverse transform distributions 
+#                         (Uniform, Exponential, Weibull, Ramp, SymTriangle, Bernoulli, Geometric, 
+#                         K-Erlang) are monotone in u and produce negatively correlated pairs, 
+#                         rejection samplers (Poisson, Binomial, ziggurat) and box-muller 
+#                         get valid but not necessarily negatively correlated samples.
+# common random numbers:  StreamFactory.synchronized() (see ThothStreams_1_0)
+
+
+def latin_hypercube(dists, n, streams=None):
+    """
+    Latin hypercube sample of n points for the distributions dists (all need ppf):
+        returns an (n, len(dists)) array, column j has exactly one sample 
+        in each of the n equiprobable strata of dists[j].
+    With one distribution this is plain stratified sampling.
+    """
+    unigen = _uniform(streams)
+    samples = np.empty((n, len(dists)))
+    for j, dist in enumerate(dists):
+        strata = np.argsort(unigen.Xn(n))
+        samples[:, j] = dist.ppf((strata + unigen.Xn(n)) / n)
+    return samples
+    
 
 #------------------------------------------------------------------------------------------------------ 
         
@@ -291,7 +1193,160 @@ def plot_distrubutions():
              KErlangDistribution(0.1,2)
             ]
     for dist in dists:
-        dist.sketch()
+        dist.sketch(pdf=True)
         
 #uncomment to test
-#plot_distrubutions() 
\ No newline at end of file
+#plot_distrubutions()
+
+
+def benchmark_batch_sampling(n=100000):
+    
+    dists = [UniformDistribution(),
+             NormalDistribution(3, 4),
+             ExponentialDistribution(3),
+             KErlangDistribution(0.1, 2),
+             WeibullDistribution(1, 1.5),
+             RampDistribution(3, 5),
+             SymmetricTriangleDistribution(-3, 8),
+             BernoulliDistribution(0.2),
+             PoissonDistribution(4),
+             PoissonDistribution(2500),
+             BinomialDistribution(20, 0.2),
+             BinomialDistribution(5000, 0.7),
+             GeometricDistribution(0.1),
+             DiscreteDistribution([1, 2, 5], [0.2, 0.5, 0.3]),
+             EmpiricalDistribution(np.arange(1000) ** 2),
+             InverseTransformDistribution(lambda u: np.tan(np.pi * (u - 0.5)), name="Cauchy")
+            ]
+    for dist in dists:
+        start = time.perf_counter()
+        scalar = [dist.X() for _ in range(n)]
+        t_scalar = time.perf_counter() - start
+        start = time.perf_counter()
+        batch = dist.Xn(n)
+        t_batch = time.perf_counter() - start
+        print("{:<30} X(): {:.3f}s  Xn(): {:.4f}s  speedup: {:>6.1f}x  mean: {:.4f} / {:.4f}".format(
+                str(dist), t_scalar, t_batch, t_scalar / t_batch, np.mean(scalar), np.mean(batch)))
+        
+
+def check_block_cache_size():
+    """ a fresh cache has the configured block size, it only grows after fast refills """
+    for cache_size in (64, 10000):
+        UniformDistribution(cache_size=cache_size)   # warm up (jump tables of the stream)
+        dist = UniformDistribution(cache_size=cache_size)
+        stats = dist.cache_stats()
+        assert stats["block_size"] == cache_size and stats["bytes"] == 8 * cache_size, stats
+        dist.Xn(2 * cache_size)   # refill right after the first one
+        assert dist.cache_stats()["block_size"] == 2 * cache_size, dist.cache_stats()
+    print("block cache size: ok")
+
+#uncomment to test
+#benchmark_batch_sampling()
+#check_block_cache_size()
+
+
+def _example_replication(streams):
+    # one replication of a tiny model, all distributions share the factory
+    arrivals = ExponentialDistribution(2, streams=streams)
+    service = KErlangDistribution(3, 2, streams=streams)
+    return np.mean(service.Xn(10000) - arrivals.Xn(10000))
+
+def example_parallel_replications(n=16):
+    
+    from ThothStreams_1_0 import run_replications
+    
+    # same results for any number of workers
+    results = run_replications(_example_replication, n)
+    assert results == run_replications(_example_replication, n, workers=1)
+    print(results)
+
+#uncomment to test
+#example_parallel_replications()
+
+
+def benchmark_shared_pool(count=10000, draws=100):
+    
+    import tracemalloc
+    from ThothStreams_1_0 import StreamFactory
+    
+    setups = [("separate", lambda: StreamFactory()),
+              ("pool shared", lambda: UniformPool(StreamFactory())),
+              ("pool dedicated", lambda: UniformPool(StreamFactory(), dedicated=True))]
+    for label, make_streams in setups:
+        tracemalloc.start()
+        start = time.perf_counter()
+        streams = make_streams()
+        dists = [NormalDistribution(1, 0.1, streams=streams) for _ in range(count)]
+        t_init = time.perf_counter() - start
+        memory_init = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        for _ in range(draws):
+            for dist in dists:
+                dist.X()
+        t_draw = time.perf_counter() - start
+        # the caches may grow while drawing (adaptive caches)
+        memory_draw = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("{:<15} {} x N(1,0.1):  init {:.2f}s  memory {:.1f} MB (after drawing {:.1f} MB)  {:.2e} draws/s".format(
+                label, count, t_init, memory_init / 2**20, memory_draw / 2**20, count * draws / t_draw))
+        del dists, streams
+
+#uncomment to test
+#benchmark_shared_pool()
+
+
+def benchmark_ziggurat(n=200000, repeats=5):
+    """ scalar X() of the ziggurat against the default method (Xn() is the same for both) """
+    from ThothStreams_1_0 import StreamFactory
+    
+    pairs = [(NormalDistribution(streams=StreamFactory()), 
+              NormalDistribution(streams=StreamFactory(), method="ziggurat")),
+             (ExponentialDistribution(1, streams=StreamFactory()), 
+              ExponentialDistribution(1, streams=StreamFactory(), method="ziggurat"))]
+    for reference, ziggurat in pairs:
+        results = []
+        for dist in (reference, ziggurat):
+            dist.X()
+            best = float('inf')
+            # best of repeats, the uniform caches are warm after the first run
+            for _ in range(repeats):
+                start = time.perf_counter()
+                samples = [dist.X() for _ in range(n)]
+                best = min(best, time.perf_counter() - start)
+            results.append((best, np.mean(samples), np.var(samples)))
+        (t_ref, mean_ref, var_ref), (t_zig, mean_zig, var_zig) = results
+        print("{:<10} X(): {} {:.0f} ns -> ziggurat {:.0f} ns ({:.2f}x)   mean/var {:.3f}/{:.3f} vs {:.3f}/{:.3f}".format(
+                str(reference), reference.METHODS[0], t_ref / n * 1e9, t_zig / n * 1e9, t_ref / t_zig, 
+                mean_ref, var_ref, mean_zig, var_zig))
+
+#uncomment to test
+#benchmark_ziggurat()
+
+
+def _example_waiting_time(streams):
+    # mean of 1000 Exp(1) service times plus 1000 2-Erlang(4) setup times
+    service = ExponentialDistribution(1, streams=streams)
+    setup = KErlangDistribution(4, 2, streams=streams)
+    return np.mean(service.Xn(1000) + setup.Xn(1000))
+
+def example_variance_reduction(n=200):
+    
+    from ThothStreams_1_0 import run_replications
+    from ThothSamples_1_0 import Estimator, CiUtil
+    
+    baseline = Estimator(n)
+    antithetic = Estimator(n)
+    for value in run_replications(_example_waiting_time, n, workers=1):
+        baseline.process_next_val(value)
+    for value in run_replications(_example_waiting_time, n, workers=1, antithetic=True):
+        antithetic.process_next_val(value)
+    print("plain:      ", baseline.ci(0.05))
+    print("antithetic: ", antithetic.ci(0.05))
+    print("variance reduction factor (per model evaluation): {:.2f}".format(
+            CiUtil.variance_reduction(baseline, antithetic, cost_ratio=2)))
+    
+    # stratified sampling of a single Exp(1)
+    print("latin hypercube (mean of Exp(1), U(2,4)):", latin_hypercube([ExponentialDistribution(1), UniformDistribution(lower=2, upper=4)], 1000).mean(axis=0))
+
+#uncomment to test
+#example_variance_reduction() 
\ No newline at end of file
@@ -7,28 +7,102 @@ Created on Wed Feb 12 13:25:58 2020
 """
 
 import numpy as np
+import math
+import functools
 
 class Estimator():
+    """
+    n = None: streaming mode, O(1) memory, no capacity needed up front
+    n = int:  array mode, additionally keeps all raw samples (all_samples()), 
+              the array starts with n entries and grows if needed
     
-    def __init__(self, n):
-        self.samples = np.zeros(n)
-        self.i = 0 #next index to fill value in
+    In both modes count, mean and M2 (sum of squared deviations) are updated 
+    incrementally (Welford), so mean/var/std/ci/good_n_estimate are O(1).
+    
+    Batches (process_batch) and partial estimators of other workers (merge, combine)
+    are added with the parallel variance formula (Chan et al.), which is exact.
+    """
+    def __init__(self, n=None):
+        self.store_samples = n is not None
+        if self.store_samples:
+            self.samples = np.zeros(n)
+        self.i = 0 #number of processed values (next index to fill value in)
+        self.running_mean = 0.0
+        self.m2 = 0.0
+        
+    def __reserve(self, n):
+        # grow the sample array (at least doubling) to hold n more samples
+        if self.i + n > self.samples.size:
+            self.samples = np.concatenate((self.samples, np.zeros(max(self.samples.size, self.i + n - self.samples.size, 1))))
+    
+    def __add_moments(self, n, mean, m2):
+        total = self.i + n
+        delta = mean - self.running_mean
+        self.running_mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.i * n / total
+        self.i = total
         
     def process_next_val(self, value):
-        self.samples[self.i] = value
+        if self.store_samples:
+            self.__reserve(1)
+            self.samples[self.i] = value
         self.i += 1
+        delta = value - self.running_mean
+        self.running_mean += delta / self.i
+        self.m2 += delta * (value - self.running_mean)
+        
+    def process_batch(self, values):
+        """ processes all values of an array in one vectorized step """
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size == 0:
+            return
+        if self.store_samples:
+            self.__reserve(values.size)
+            self.samples[self.i:self.i + values.size] = values
+        mean = values.mean()
+        self.__add_moments(values.size, mean, np.sum((values - mean) ** 2))
+    
+    def merge(self, other):
+        """
+        adds the statistics (and samples) of another Estimator, e.g. the partial 
+        estimator of a worker process, returns self
+        """
+        if other.i == 0:
+            return self
+        if self.store_samples:
+            if not other.store_samples:
+                raise ValueError("A streaming Estimator cannot be merged into an Estimator that keeps its samples.")
+            self.__reserve(other.i)
+            self.samples[self.i:self.i + other.i] = other.all_samples()
+        self.__add_moments(other.i, other.running_mean, other.m2)
+        return self
+    
+    @staticmethod
+    def combine(estimators):
+        """
+        reduces partial estimators into a new one, 
+        it keeps the samples only if all of them do
+        """
+        estimators = list(estimators)
+        keep = all(est.store_samples for est in estimators)
+        combined = Estimator(sum(est.i for est in estimators) if keep else None)
+        for est in estimators:
+            combined.merge(est)
+        return combined
         
     def all_samples(self):
+        if not self.store_samples:
+            raise ValueError("A streaming Estimator does not keep its samples. Use Estimator(n) instead.")
         return self.samples[0:self.i]
     
     def mean(self):
-        return np.mean(self.all_samples())
+        return self.running_mean if self.i > 0 else np.nan
     
     def var(self):
-        return np.var(self.all_samples(), ddof=1)
+        return self.m2 / (self.i - 1) if self.i > 1 else np.nan
     
     def std(self):
-        return np.std(self.all_samples(), ddof=1)
+        return self.var() ** 0.5
     
     def ci(self, tolerance):
         """
@@ -39,12 +113,16 @@ class Estimator():
         e.g. tolerance=0.05 means:
             P(μ* ∈ [μ-halfwidth,μ+halfwidth] )  = 1- 0.05
             P(μ-halfwidth ≤ μ* ≤ μ+half_width)  = 1- 0.05
+        
+        uses the student t quantile for n ≤ CiUtil.T_QUANTILE_MAX_N, the normal one above
         """
-        z_gamma = CiUtil.zgamma(tolerance)
-        half_width = (z_gamma * self.std()) / (self.i ** 0.5)
+        z_gamma = CiUtil.quantile(tolerance, self.i)
+        std = self.std()
+        # no observations yet: nan, not a division by zero
+        half_width = (z_gamma * std) / (self.i ** 0.5) if self.i > 0 else np.nan
         
          # return (μ, half_width)
-        return ConfidenceInterval(self.mean(), half_width, z_gamma=z_gamma, std=self.std(), n=self.i)
+        return ConfidenceInterval(self.mean(), half_width, z_gamma=z_gamma, std=std, n=self.i)
      
     def good_n_estimate(self, delta=0.05, eps=(0.05,'rel')):
         '''
@@ -60,6 +138,364 @@ class Estimator():
     
 #------------------------------------------------------------------------------------------------------ 
         
+#------------------------------------   Autocorrelated output -----------------------------------------
+
+#------------------------------------------------------------------------------------------------------ 
+
+class BatchMeansEstimator():
+    """
+    Estimator for one long run of autocorrelated output (e.g. successive waiting times).
+    
+    The observations are grouped into consecutive batches, the batch means are 
+    (nearly) independent if the batches are long enough. At most max_batches 
+    batch means are kept: when they are full, neighbouring batches are merged 
+    and the batch size doubles, so the memory stays O(max_batches) for any run length.
+    
+    var() = batch_size * var(batch means), the variance per observation that 
+    accounts for the autocorrelation, so n_that_fits_CI/good_n_estimate work unchanged.
+    ci() uses the student t quantile with (#batches - 1) degrees of freedom.
+    
+    Remove the warm-up period first (see MSERTruncatedEstimator).
+    """
+    def __init__(self, max_batches=64):
+        if max_batches < 4 or max_batches % 2:
+            raise ValueError("max_batches has to be an even number ≥ 4, got {}".format(max_batches))
+        self.max_batches = max_batches
+        self.batch_means = np.zeros(max_batches)
+        self.k = 0               # number of complete batches
+        self.batch_size = 1
+        self.partial_sum = 0.0   # current, incomplete batch
+        self.partial_n = 0
+        self.i = 0               # number of processed values
+        self.total = 0.0
+    
+    def __collapse(self):
+        # merge neighbouring batches, the batch size doubles
+        half = self.k // 2
+        self.batch_means[:half] = (self.batch_means[0:self.k:2] + self.batch_means[1:self.k:2]) / 2
+        self.k = half
+        self.batch_size *= 2
+    
+    def __close_batch(self, mean):
+        self.batch_means[self.k] = mean
+        self.k += 1
+        if self.k == self.max_batches:
+            # collapse right away, while the partial batch is empty
+            self.__collapse()
+    
+    def process_next_val(self, value):
+        self.i += 1
+        self.total += value
+        self.partial_sum += value
+        self.partial_n += 1
+        if self.partial_n == self.batch_size:
+            self.__close_batch(self.partial_sum / self.batch_size)
+            self.partial_sum = 0.0
+            self.partial_n = 0
+    
+    def process_batch(self, values):
+        """ processes all values of an array, full batches in vectorized steps """
+        values = np.asarray(values, dtype=float).ravel()
+        self.i += values.size
+        self.total += values.sum()
+        pos = 0
+        while pos < values.size:
+            if self.partial_n > 0:
+                # complete the current batch first
+                take = min(self.batch_size - self.partial_n, values.size - pos)
+                self.partial_sum += values[pos:pos + take].sum()
+                self.partial_n += take
+                pos += take
+                if self.partial_n == self.batch_size:
+                    self.__close_batch(self.partial_sum / self.batch_size)
+                    self.partial_sum = 0.0
+                    self.partial_n = 0
+            else:
+                full = min((values.size - pos) // self.batch_size, self.max_batches - self.k)
+                if full == 0:
+                    self.partial_sum = values[pos:].sum()
+                    self.partial_n = values.size - pos
+                    break
+                end = pos + full * self.batch_size
+                self.batch_means[self.k:self.k + full] = values[pos:end].reshape(full, self.batch_size).mean(axis=1)
+                self.k += full
+                pos = end
+                if self.k == self.max_batches:
+                    self.__collapse()
+    
+    def all_batch_means(self):
+        return self.batch_means[0:self.k]
+    
+    def mean(self):
+        return self.total / self.i if self.i > 0 else np.nan
+    
+    def var(self):
+        return self.batch_size * np.var(self.all_batch_means(), ddof=1) if self.k > 1 else np.nan
+    
+    std = Estimator.std
+    
+    def batch_autocorrelation(self):
+        """ lag-1 autocorrelation of the batch means, should be close to 0 (e.g. < 0.2) """
+        if self.k < 3:
+            return np.nan
+        centered = self.all_batch_means() - self.all_batch_means().mean()
+        return np.dot(centered[:-1], centered[1:]) / np.dot(centered, centered)
+    
+    def ci(self, tolerance):
+        """
+        μ ± halfwidth with P(μ* ∈ [μ-halfwidth,μ+halfwidth]) = 1 - tolerance, 
+        from the batch means (student t quantile, #batches - 1 degrees of freedom)
+        """
+        z_gamma = CiUtil.quantile(tolerance, self.k)
+        std = self.std()
+        half_width = z_gamma * std / (self.k * self.batch_size) ** 0.5 if self.k > 0 else np.nan
+        return ConfidenceInterval(self.mean(), half_width, z_gamma=z_gamma, std=std, n=self.i)
+    
+    good_n_estimate = Estimator.good_n_estimate
+
+
+class MSERTruncatedEstimator():
+    """
+    Warm-up detection with the MSER-m rule (m = 5: MSER-5, White 1997):
+    the output is reduced to means of m observations Y_1..Y_b, the truncation 
+    point d minimizes
+        MSER(d) = 1/(b-d)^2 * Σ_{j>d} (Y_j - mean(Y_{d+1..b}))^2
+    over d ≤ b/2 (a truncation in the second half means the run is too short).
+    
+    Keeps only the b means of m observations (memory n/m). mean/var/ci/good_n_estimate 
+    refer to the observations after the truncation point, the ci uses batch means 
+    (BatchMeansEstimator), i.e. it accounts for the autocorrelation.
+    """
+    def __init__(self, m=5, max_batches=64):
+        self.m = m
+        self.max_batches = max_batches
+        self.means = np.zeros(64)
+        self.b = 0               # number of complete m-means
+        self.partial_sum = 0.0
+        self.partial_n = 0
+        self.i = 0               # number of processed values
+        self.__cached = None     # (b, truncation, BatchMeansEstimator)
+    
+    def __append(self, means):
+        if self.b + means.size > self.means.size:
+            self.means = np.concatenate((self.means, np.zeros(max(self.means.size, self.b + means.size - self.means.size))))
+        self.means[self.b:self.b + means.size] = means
+        self.b += means.size
+    
+    def process_next_val(self, value):
+        self.i += 1
+        self.partial_sum += value
+        self.partial_n += 1
+        if self.partial_n == self.m:
+            self.__append(np.array([self.partial_sum / self.m]))
+            self.partial_sum = 0.0
+            self.partial_n = 0
+    
+    def process_batch(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        self.i += values.size
+        if self.partial_n > 0:
+            take = min(self.m - self.partial_n, values.size)
+            self.partial_sum += values[:take].sum()
+            self.partial_n += take
+            if self.partial_n == self.m:
+                self.__append(np.array([self.partial_sum / self.m]))
+                self.partial_sum = 0.0
+                self.partial_n = 0
+            values = values[take:]
+        full = values.size // self.m
+        if full > 0:
+            self.__append(values[:full * self.m].reshape(full, self.m).mean(axis=1))
+        if values.size > full * self.m:
+            self.partial_sum = values[full * self.m:].sum()
+            self.partial_n = values.size - full * self.m
+    
+    def mser(self):
+        """ MSER(d) for d = 0 .. b/2 (in units of m observations) """
+        y = self.means[0:self.b]
+        y = y - y.mean()   # less cancellation in the sums of squares
+        count = np.arange(self.b, 0, -1, dtype=float)
+        s1 = np.cumsum(y[::-1])[::-1]
+        s2 = np.cumsum((y * y)[::-1])[::-1]
+        d_max = self.b // 2 + 1
+        return ((s2 - s1 * s1 / count) / count ** 2)[:d_max]
+    
+    def truncation(self):
+        """ number of observations to delete as warm-up """
+        return self.__steady_state()[1]
+    
+    def __steady_state(self):
+        if self.__cached is None or self.__cached[0] != self.b:
+            d = int(np.argmin(self.mser())) if self.b > 1 else 0
+            bm = BatchMeansEstimator(self.max_batches)
+            bm.process_batch(self.means[d:self.b])
+            self.__cached = (self.b, d * self.m, bm)
+        return self.__cached
+    
+    def steady_state_estimator(self):
+        """ BatchMeansEstimator over the m-means after the truncation point """
+        return self.__steady_state()[2]
+    
+    def mean(self):
+        return self.steady_state_estimator().mean()
+    
+    def var(self):
+        # the batch means estimator sees means of m observations
+        return self.m * self.steady_state_estimator().var()
+    
+    std = Estimator.std
+    
+    def ci(self, tolerance):
+        """ CI of the steady state mean (observations after the truncation point) """
+        ci = self.steady_state_estimator().ci(tolerance)
+        return ConfidenceInterval(ci.mean, ci.halfwidth, z_gamma=ci.z_gamma, std=self.std(), n=ci.n * self.m)
+    
+    good_n_estimate = Estimator.good_n_estimate
+    
+#------------------------------------------------------------------------------------------------------ 
+        
+#------------------------------------   Quantile estimation -------------------------------------------
+
+#------------------------------------------------------------------------------------------------------ 
+
+class QuantileSketch():
+    """
+    Mergeable quantile sketch with bounded memory (KLL, Karnin/Lang/Liberty 2016).
+    
+    Level h holds items of weight 2^h. A full level is sorted and every second 
+    item (random offset) is promoted to level h+1, level capacities shrink 
+    geometrically (factor 2/3) towards the bottom, so the sketch keeps k to 3k items. 
+    The normalized rank error is about 1/k, uniform over all quantiles 
+    (k=1000: ≈0.1%, i.e. the estimated p99 lies between p98.9 and p99.1, ≤ 24 kB).
+    
+    Each compaction at level h moves the rank of any value by 0 or ±2^h with equal 
+    probability, their sum of variances is tracked (rank_var) and added to the 
+    order statistic CI. As long as nothing has been compacted the sketch is exact.
+    
+    example:
+        sketch = QuantileSketch()
+        sketch.process_batch(latencies)
+        p50, p95, p99 = sketch.quantile([0.5, 0.95, 0.99])
+        print(sketch.ci(0.99, 0.05))
+    """
+    def __init__(self, k=1000, seed=None):
+        if k < 8:
+            raise ValueError("k has to be ≥ 8, got {}".format(k))
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.levels = [np.zeros(0)]
+        self.buffer = []           # single values, added to level 0 in blocks of k
+        self.i = 0                 # number of processed values
+        self.rank_var = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+    
+    def __capacity(self, h):
+        return max(2, int(np.ceil(self.k * (2.0 / 3.0) ** (len(self.levels) - 1 - h))))
+    
+    def __compress(self):
+        h = 0
+        while h < len(self.levels):
+            if self.levels[h].size > self.__capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0))
+                level = np.sort(self.levels[h])
+                even = level.size - level.size % 2
+                promoted = level[self.rng.integers(2):even:2]
+                self.levels[h] = level[even:]
+                self.levels[h + 1] = np.concatenate((self.levels[h + 1], promoted))
+                self.rank_var += 4.0 ** h
+            h += 1
+    
+    def __flush(self):
+        if self.buffer:
+            values = np.array(self.buffer)
+            self.buffer = []
+            self.levels[0] = np.concatenate((self.levels[0], values))
+            self.__compress()
+    
+    def process_next_val(self, value):
+        self.buffer.append(value)
+        self.i += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self.buffer) >= self.k:
+            self.__flush()
+    
+    def process_batch(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size == 0:
+            return
+        self.__flush()
+        self.i += values.size
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        # a large block is compacted level by level, i.e. with a few sorts
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self.__compress()
+    
+    def merge(self, other):
+        """ adds the sketch of another worker, returns self """
+        self.__flush()
+        other.__flush()
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0))
+        for h, level in enumerate(other.levels):
+            self.levels[h] = np.concatenate((self.levels[h], level))
+        self.i += other.i
+        self.rank_var += other.rank_var
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.__compress()
+        return self
+    
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels) + 8 * len(self.buffer)
+    
+    def __sorted_items(self):
+        self.__flush()
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(level.size, 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+    
+    def rank(self, x):
+        """ estimated number of processed values ≤ x """
+        items, cum_weights = self.__sorted_items()
+        idx = np.searchsorted(items, x, side='right')
+        return np.where(idx > 0, cum_weights[np.maximum(idx - 1, 0)], 0.0)
+    
+    def quantile(self, q):
+        """ smallest value x with rank(x) ≥ q * n, q can be an array """
+        if self.i == 0:
+            raise ValueError("The sketch is empty.")
+        q = np.asarray(q, dtype=float)
+        if np.any((q < 0) | (q > 1)):
+            raise ValueError("q has to be in [0,1]")
+        items, cum_weights = self.__sorted_items()
+        idx = np.minimum(np.searchsorted(cum_weights, q * self.i, side='left'), items.size - 1)
+        result = np.where(q <= 0, self.min, np.where(q >= 1, self.max, items[idx]))
+        return result if result.ndim else float(result)
+    
+    def ci(self, q, tolerance):
+        """
+        distribution free CI for the q-quantile from order statistics:
+            [x_(l), x_(u)] with l,u = n*q ∓ z_gamma * sqrt(n*q*(1-q) + rank_var)
+        returned as ConfidenceInterval(quantile estimate, lower=x_(l), upper=x_(u)),
+        halfwidth is the larger distance to the estimate
+        """
+        z_gamma = CiUtil.zgamma(tolerance)
+        spread = z_gamma * (self.i * q * (1 - q) + self.rank_var) ** 0.5
+        lower_rank = max(np.floor(self.i * q - spread), 0)
+        upper_rank = min(np.ceil(self.i * q + spread), self.i)
+        estimate, lower, upper = self.quantile([q, lower_rank / self.i, upper_rank / self.i])
+        return ConfidenceInterval(estimate, max(upper - estimate, estimate - lower), z_gamma=z_gamma, 
+                                  n=self.i, lower=lower, upper=upper)
+
+#------------------------------------------------------------------------------------------------------ 
+        
 #------------------------------------   Confidence Interval Management -------------------------------- 
 
 #------------------------------------------------------------------------------------------------------ 
@@ -67,15 +503,26 @@ class Estimator():
 
 
 class ConfidenceInterval:
-    def __init__(self, mean, halfwidth, z_gamma=None, std=None, n=None):
+    """
+    mean ± halfwidth, or an asymmetric interval [lower, upper] around the 
+    estimate (e.g. quantiles), then halfwidth is the larger of both distances
+    """
+    def __init__(self, mean, halfwidth, z_gamma=None, std=None, n=None, lower=None, upper=None):
         self.mean = mean
         self.halfwidth = halfwidth
         self.z_gamma = z_gamma
         self.std=std
         self.n=n
+        self.lower = mean - halfwidth if lower is None else lower
+        self.upper = mean + halfwidth if upper is None else upper
+        self.symmetric = lower is None and upper is None
         
     def __str__(self, output_precision=4):
         mean = np.round(self.mean, decimals=output_precision)
+        if not self.symmetric:
+            lower = np.round(self.lower, decimals=output_precision)
+            upper = np.round(self.upper, decimals=output_precision)
+            return "[CI:{} in [{}, {}]]".format(mean, lower, upper)
         halfwidth = np.round(self.halfwidth, decimals=output_precision)
         return "[CI:{} ± {}]".format(mean, halfwidth)
        
@@ -124,31 +571,28 @@ class CiUtil:
 #        = 1 - 0.5*delta
 #
     
-    zgamma_loockup = {   0.6    : 0.253, 
-                         0.7    : 0.524, 
-                         0.8    : 0.842,
-                         0.9    : 1.282, 
-                         0.9333 : 1.501, 
-                         0.95   : 1.645,   #0.1    = 10% 
-                         0.96   : 1.751, 
-                         0.9667 : 1.834, 
-                         0.975  : 1.960,   #0.05  = 5% 
-                         0.98   : 2.054,   #0.04  = 4% 
-                         0.9833 : 2.127, 
-                         0.9875 : 2.241,   #0.025 = 2.5%
-                         0.99   : 2.326,   #0.02  = 2%
-                         0.9917 : 2.395, 
-                         0.9928 : 2.501,   
-                         0.995  : 2.576    # 0.01 = 1%
-                      }   
+    # Estimator.ci uses student t quantiles up to this n (z_0.975 = 1.960, t_0.975(999) = 1.962)
+    T_QUANTILE_MAX_N = 1000
     
+    @functools.lru_cache(maxsize=4096)
     def zgamma(delta):
-        gamma = 1-(delta/2)
-        discrete_gamma = np.round(gamma, decimals=4)
-        if discrete_gamma not in CiUtil.zgamma_loockup:
-            raise ValueError('The delta value (=' + str(delta)+ ') for the confidence interval is not supported.')
-        z_gamma = CiUtil.zgamma_loockup[discrete_gamma]
-        return z_gamma
+        """ normal quantile z_gamma for gamma = 1 - delta/2 (memoized) """
+        if not 0 < delta < 1:
+            raise ValueError('The delta value (=' + str(delta)+ ') for the confidence interval has to be in (0,1).')
+        return -norm_ppf(delta / 2)
+    
+    @functools.lru_cache(maxsize=4096)
+    def tgamma(delta, dof):
+        """ student t quantile t_gamma(dof) for gamma = 1 - delta/2 (memoized) """
+        if not 0 < delta < 1:
+            raise ValueError('The delta value (=' + str(delta)+ ') for the confidence interval has to be in (0,1).')
+        return student_t_two_tailed_inv(delta, dof)
+    
+    def quantile(delta, n):
+        """ t quantile (n-1 degrees of freedom) for small n, normal quantile for large n """
+        if 1 < n <= CiUtil.T_QUANTILE_MAX_N:
+            return CiUtil.tgamma(delta, n - 1)
+        return CiUtil.zgamma(delta)
     
     def n_that_fits_CI(estParams, estimator):
             """
@@ -175,7 +619,195 @@ class CiUtil:
                 # Estimate μ to within ±eps with probabilty (1-delta)
                 denumerator =  (estParams.abs_eps**2) 
             return numerator  /  denumerator
+    
+    def fits_CI(ci, estParams):
+        """ True if the ConfidenceInterval is as narrow as requested by the EstParams """
+        if estParams.has_relative_eps:
+            return ci.halfwidth <= estParams.rel_eps * abs(ci.mean)
+        return ci.halfwidth <= estParams.abs_eps
+    
+    def sequential_CI(sampler, estParams, pilot_n=1000, growth=2.0, max_n=None, estimator=None):
+        """
+        Runs a simulation until the CI requested by estParams is reached:
+            1) a pilot batch of pilot_n samples
+            2) extend the run by the remaining n predicted by n_that_fits_CI, 
+               but at most by a factor of growth (geometric growth), 
+               until the CI fits or max_n samples are used up
+        
+        sampler     = sampler(n) returns n samples (e.g. dist.Xn, or 
+                      lambda n: [simulate() for _ in range(n)])
+        [max_n]     = sample budget, the run stops there even if the CI does not fit
+        [estimator] = Estimator to feed (default: streaming Estimator())
         
+        returns (ConfidenceInterval, number of samples used)
+        
+        example:
+            CiUtil.sequential_CI(ExponentialDistribution(3).Xn, CiUtil.EstParams(0.05, 0.01, 'rel'))
+        """
+        est = Estimator() if estimator is None else estimator
+        batch = pilot_n if max_n is None else min(pilot_n, max_n)
+        while True:
+            est.process_batch(sampler(batch))
+            ci = est.ci(estParams.delta)
+            if CiUtil.fits_CI(ci, estParams) or (max_n is not None and est.i >= max_n):
+                return ci, est.i
+            batch = int(est.i * (growth - 1))
+            needed = CiUtil.n_that_fits_CI(estParams, est)
+            if np.isfinite(needed):
+                # a bit more than predicted, the prediction itself is noisy
+                batch = min(batch, max(int(np.ceil(1.05 * needed)) - est.i, int(0.05 * est.i)))
+            batch = max(batch, 1)
+            if max_n is not None:
+                batch = min(batch, max_n - est.i)
+    
+    def variance_reduction(baseline, reduced, cost_ratio=1.0):
+        """
+        Returns the factor by which the variance reduced estimator needs fewer 
+        model evaluations than the baseline for the same CI halfwidth:
+            var(baseline) / (var(reduced) * cost_ratio)
+        
+        baseline   = Estimator over independent observations
+        reduced    = Estimator over variance reduced observations 
+                     (antithetic pair means, CRN differences, stratified means, ...)
+        cost_ratio = model evaluations per reduced observation / per baseline observation
+                     (e.g. 2 if each reduced observation is the mean of an antithetic pair)
+        
+        factor > 1 means the variance reduction pays off
+        """
+        return baseline.var() / (reduced.var() * cost_ratio)
+        
+    
+    
+#------------------------------------------------------------------------------------------------------ 
+        
+#-------------------------------------------    Quantile functions  ---------------------------------- 
+
+#------------------------------------------------------------------------------------------------------ 
+
+# Acklam's rational approximation of the normal quantile (rel. error < 1.2e-9),
+# refined with one Halley step on math.erfc (full double precision)
+_ACKLAM_A = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 
+              1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+_ACKLAM_B = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 
+              6.680131188771972e+01, -1.328068155288572e+01)
+_ACKLAM_C = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, 
+             -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+_ACKLAM_D = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00)
+_ACKLAM_P_LOW = 0.02425
+
+def norm_ppf(p):
+    """ x such that P(X ≤ x) = p for X∼N(0,1) """
+    if not 0 < p < 1:
+        raise ValueError("p has to be in (0,1), got {}".format(p))
+    if p > 0.5:
+        # the refinement below is exact only for the lower half (no cancellation in erfc)
+        return -norm_ppf(1 - p)
+    a, b, c, d = _ACKLAM_A, _ACKLAM_B, _ACKLAM_C, _ACKLAM_D
+    if p < _ACKLAM_P_LOW:
+        q = math.sqrt(-2 * math.log(p))
+        x = (((((c[0]*q + c[1])*q + c[2])*q + c[3])*q + c[4])*q + c[5]) / ((((d[0]*q + d[1])*q + d[2])*q + d[3])*q + 1)
+    else:
+        q = p - 0.5
+        r = q * q
+        x = (((((a[0]*r + a[1])*r + a[2])*r + a[3])*r + a[4])*r + a[5])*q / (((((b[0]*r + b[1])*r + b[2])*r + b[3])*r + b[4])*r + 1)
+    e = 0.5 * math.erfc(-x / math.sqrt(2)) - p
+    u = e * math.sqrt(2 * math.pi) * math.exp(x * x / 2)
+    return x - u / (1 + x * u / 2)
+
+
+def _betacf(a, b, x):
+    # continued fraction of the regularized incomplete beta function (modified Lentz)
+    tiny = 1e-300
+    c, d = 1.0, 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        for aa in (m * (b - m) * x / ((a + 2*m - 1) * (a + 2*m)),
+                   -(a + m) * (a + b + m) * x / ((a + 2*m) * (a + 2*m + 1))):
+            d = 1 + aa * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + aa / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1) < 1e-15:
+            break
+    return h
+
+def _betainc(a, b, x):
+    # regularized incomplete beta function I_x(a, b)
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    log_front = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log1p(-x)
+    if x < (a + 1) / (a + b + 2):
+        return math.exp(log_front) * _betacf(a, b, x) / a
+    return 1 - math.exp(log_front) * _betacf(b, a, 1 - x) / b
+
+def student_t_two_tailed(t, dof):
+    """ P(|T| > t) for T∼t(dof) """
+    return _betainc(dof / 2, 0.5, dof / (dof + t * t))
+
+def student_t_pdf(t, dof):
+    return math.exp(math.lgamma((dof + 1) / 2) - math.lgamma(dof / 2) - 0.5 * math.log(dof * math.pi) 
+                    - (dof + 1) / 2 * math.log1p(t * t / dof))
+
+def student_t_two_tailed_inv(p, dof):
+    """
+    t > 0 such that P(|T| > t) = p for T∼t(dof)
+    Hill's algorithm 396 (1970), for dof < 1000 refined with two Newton steps 
+    on the exact tail probability (rel. error ~1e-12)
+    """
+    if not 0 < p < 1:
+        raise ValueError("p has to be in (0,1), got {}".format(p))
+    if dof <= 0:
+        raise ValueError("dof has to be positive, got {}".format(dof))
+    n = dof
+    if n == 2:
+        return math.sqrt(2 / (p * (2 - p)) - 2)
+    if n == 1:
+        return 1 / math.tan(p * math.pi / 2)
+    a = 1 / (n - 0.5)
+    b = 48 / (a * a)
+    c = ((20700 * a / b - 98) * a - 16) * a + 96.36
+    d = ((94.5 / (b + c) - 3) / b + 1) * math.sqrt(a * math.pi / 2) * n
+    y = (d * p) ** (2 / n)
+    if y > 0.05 + a:
+        x = norm_ppf(0.5 * p)
+        y = x * x
+        if n < 5:
+            c += 0.3 * (n - 4.5) * (x + 0.6)
+        c = (((0.05 * d * x - 5) * x - 7) * x - 2) * x + b + c
+        y = (((((0.4 * y + 6.3) * y + 36) * y + 94.5) / c - y - 3) / b + 1) * x
+        y = math.expm1(a * y * y)
+    else:
+        y = ((1 / (((n + 6) / (n * y) - 0.089 * d - 0.822) * (n + 2) * 3) + 0.5 / (n + 4)) * y - 1) * (n + 1) / (n + 2) + 1 / y
+    t = math.sqrt(n * y)
+    if n < 1000:
+        for _ in range(2):
+            t += (student_t_two_tailed(t, n) - p) / (2 * student_t_pdf(t, n))
+    return t
+
+def student_t_ppf(p, dof):
+    """ t such that P(T ≤ t) = p for T∼t(dof) """
+    if p == 0.5:
+        return 0.0
+    t = student_t_two_tailed_inv(2 * min(p, 1 - p), dof)
+    return t if p > 0.5 else -t
+
+
+def check_empty_ci():
+    """ estimators without observations return a nan CI (e.g. printed before the data arrives) """
+    for est in (Estimator(), Estimator(10), BatchMeansEstimator()):
+        ci = est.ci(0.05)
+        assert np.isnan(ci.mean) and np.isnan(ci.halfwidth), (est, ci)
+    bm = BatchMeansEstimator()
+    bm.process_next_val(1.0)   # partial batch only
+    assert np.isnan(bm.ci(0.05).halfwidth)
+    print("empty ci: ok")
+
+#uncomment to test
+#check_empty_ci()
     
     
 #------------------------------------------------------------------------------------------------------ 
@@ -184,12 +816,36 @@ class CiUtil:
 
 #------------------------------------------------------------------------------------------------------ 
 """
-est = Estimator(4)
+est = Estimator()      # streaming, use Estimator(n) to keep the samples
 est.process_next_val(124.2)
 est.process_next_val(128.3)
 est.process_next_val(100.9)
 print(est.ci(0.02))
 
+# batches and partial estimators (e.g. of worker processes)
+part1, part2 = Estimator(), Estimator()
+part1.process_batch(np.array([124.2, 128.3]))
+part2.process_batch(np.array([100.9]))
+print(Estimator.combine([part1, part2]).ci(0.02))
+
+# simulate until μ is known within ±1% (95%), at most 10^6 samples
+ci, n = CiUtil.sequential_CI(lambda n: np.random.exponential(3, n), CiUtil.EstParams(0.05, 0.01, 'rel'), max_n=10**6)
+print(ci, n)
+
+# p50/p95/p99 with bounded memory, sketches of workers can be merged
+sketch = QuantileSketch()
+sketch.process_batch(np.random.exponential(3, 10**6))
+print(sketch.quantile([0.5, 0.95, 0.99]), sketch.ci(0.99, 0.05))
+
+# one long run of autocorrelated waiting times (M/M/1, ρ = 0.8, Lindley recursion)
+a, x = np.random.exponential(1.25, 10**6), np.random.exponential(1.0, 10**6)
+w = np.zeros(10**6)
+for j in range(1, 10**6):
+    w[j] = max(0.0, w[j-1] + x[j-1] - a[j])
+mser = MSERTruncatedEstimator()
+mser.process_batch(w)
+print(mser.truncation(), mser.ci(0.05), mser.good_n_estimate(0.05, (0.01, 'rel')))  # E[W] = 4
+
 k1 = CiUtil.n_that_fits_CI(CiUtil.EstParams(delta=0.05, eps=0.01, eps_type='abs'), est)
 print(k1)
 k2 = CiUtil.n_that_fits_CI(CiUtil.EstParams(0.05, 3.1, 'abs'), est)
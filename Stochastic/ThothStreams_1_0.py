@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:12:31 2026
+@author: Lukas Baur
+
+Stream management for the MRG32k3a generator (L'Ecuyer's RngStream).
+
+L'Ecuyer's layout of the period (~2^191):
+    - streams    of length 2^127
+    - substreams of length 2^76  (2^51 per stream)
+
+A StreamFactory hands out
+    stream    c  to the c-th consumer (distribution) that asks for one
+    substream r  for replication r
+so no two (consumer, replication) pairs ever overlap, and the same consumer
+draws from the same stream in every replication. The seeds are computed
+with jump-ahead matrices, i.e. they only depend on (seed, consumer, replication),
+not on the process or the order in which replications are executed.
+
+Generators (backend):
+    - "numpy":     MRG32k3a of this module, vectorized over lanes (default)
+    - "rngstream": rngStream_n.RngStream (external package, only imported if requested)
+    Both produce the same numbers for the same seed.
+
+Variance reduction:
+    - antithetic:              factory.antithetic_twin() hands out the same streams, 
+                               but the uniform distributions emit 1-u instead of u
+    - common random numbers:   factory.synchronized() for a second model variant, 
+                               streams are matched by name instead of creation order
+"""
+
+import functools
+import multiprocessing
+import numpy as np
+
+#------------------------------------------------------------------------------------------------------
+
+#------------------------------------   MRG32k3a jump ahead -------------------------------------------
+
+#------------------------------------------------------------------------------------------------------
+
+M1 = 4294967087
+M2 = 4294944443
+
+# one step transition matrices of both components
+A1 = [[0, 1, 0], [0, 0, 1], [M1 - 810728, 1403580, 0]]
+A2 = [[0, 1, 0], [0, 0, 1], [M2 - 1370589, 0, 527612]]
+
+DEFAULT_SEED = (12345, 12345, 12345, 12345, 12345, 12345)
+
+
+def _mat_mult(A, B, m):
+    return [[sum(A[i][k] * B[k][j] for k in range(3)) % m for j in range(3)] for i in range(3)]
+
+def _mat_vec(A, v, m):
+    return [sum(A[i][j] * v[j] for j in range(3)) % m for i in range(3)]
+
+def _mat_pow(A, e, m):
+    # A^e mod m (square and multiply)
+    result = [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+    while e > 0:
+        if e & 1:
+            result = _mat_mult(result, A, m)
+        A = _mat_mult(A, A, m)
+        e >>= 1
+    return result
+
+def _mat_pow2(A, e, m):
+    # A^(2^e) mod m
+    for _ in range(e):
+        A = _mat_mult(A, A, m)
+    return A
+
+A1P76  = _mat_pow2(A1, 76, M1)
+A2P76  = _mat_pow2(A2, 76, M2)
+A1P127 = _mat_pow2(A1, 127, M1)
+A2P127 = _mat_pow2(A2, 127, M2)
+
+
+def check_seed(seed):
+    if len(seed) != 6:
+        raise ValueError("A MRG32k3a seed consists of 6 integers, got {}".format(len(seed)))
+    if any(s < 0 for s in seed) or any(s >= M1 for s in seed[:3]) or any(s >= M2 for s in seed[3:]):
+        raise ValueError("Seed values have to be in [0,{}) (first 3) and [0,{}) (last 3)".format(M1, M2))
+    if not any(seed[:3]) or not any(seed[3:]):
+        raise ValueError("The first 3 and the last 3 seed values must not all be 0")
+
+def advance_seed(seed, streams=0, substreams=0):
+    """
+    returns the state reached from seed after
+        streams * 2^127 + substreams * 2^76
+    steps of the generator
+    """
+    s1, s2 = list(seed[:3]), list(seed[3:])
+    if streams:
+        s1 = _mat_vec(_mat_pow(A1P127, streams, M1), s1, M1)
+        s2 = _mat_vec(_mat_pow(A2P127, streams, M2), s2, M2)
+    if substreams:
+        s1 = _mat_vec(_mat_pow(A1P76, substreams, M1), s1, M1)
+        s2 = _mat_vec(_mat_pow(A2P76, substreams, M2), s2, M2)
+    return tuple(s1 + s2)
+
+#------------------------------------------------------------------------------------------------------
+
+#------------------------------------   Vectorized MRG32k3a -------------------------------------------
+
+#------------------------------------------------------------------------------------------------------
+
+NORM = 2.328306549295727688e-10  # 1 / (M1 + 1)
+
+# a fill of n values runs L ≤ MAX_LANES lanes of K consecutive values of the stream
+# side by side, lane j starts at A^(jK) * state (precomputed per K)
+MAX_LANES = 4096
+MIN_LANE_LENGTH = 16
+# below this a fill is computed value by value (the lane setup costs ~0.4 ms)
+MIN_VECTOR_FILL = 512
+# larger fills are computed in segments of this many values (bounded lane state)
+SEGMENT_VALUES = 2**18
+
+DEFAULT_BACKEND = "numpy"
+
+# package seed of streams created without seed (like rngStream_n's nextSeed)
+_next_seed = list(DEFAULT_SEED)
+
+
+def _mat_mult_n(P, M, m):
+    # P * M[j] mod m for a python matrix P and an int64 array M of shape (n, 3, 3),
+    # P is split into 16 bit halves, so all products stay below 2^48
+    result = np.zeros_like(M)
+    for i in range(3):
+        for l in range(3):
+            hi, lo = P[i][l] >> 16, P[i][l] & 0xFFFF
+            result[:, i, :] += ((hi * M[:, l, :]) % m * 65536 + lo * M[:, l, :]) % m
+        result[:, i, :] %= m
+    return result
+
+@functools.lru_cache(maxsize=16)
+def _lane_jumps(lane_length):
+    # A^(j * lane_length) for j ≤ MAX_LANES (int64 arrays of shape (MAX_LANES + 1, 3, 3)), by doubling
+    jumps = []
+    for A, m in ((A1, M1), (A2, M2)):
+        step = _mat_pow(A, lane_length, m)
+        matrices = np.array([[[1, 0, 0], [0, 1, 0], [0, 0, 1]]], dtype=np.int64)
+        while matrices.shape[0] < MAX_LANES + 1:
+            matrices = np.concatenate((matrices, _mat_mult_n(step, matrices, m)))
+            step = _mat_mult(step, step, m)
+        jumps.append(matrices[:MAX_LANES + 1])
+    return jumps
+
+def _jump_lanes(jump, state, lanes, m):
+    # lane start states A^(jK) * state as 3 float64 arrays of length lanes
+    M = jump[:lanes]
+    result = []
+    for i in range(3):
+        x = np.zeros(lanes, dtype=np.int64)
+        for k in range(3):
+            hi, lo = state[k] >> 16, state[k] & 0xFFFF
+            x += ((M[:, i, k] * hi) % m * 65536 + M[:, i, k] * lo) % m
+        result.append((x % m).astype(np.float64))
+    return result
+
+
+class MRG32k3a:
+    """
+    L'Ecuyer's MRG32k3a, same recurrence, seeds and (sub)stream jumps as 
+    rngStream_n.RngStream, i.e. the same numbers for the same seed.
+    
+    fill(out) writes the next out.size uniforms straight into a float64 array: 
+    the block is split into lanes of K consecutive values, each lane starts at 
+    its jump ahead state and all lanes are advanced together with numpy
+    (fills above SEGMENT_VALUES are computed segment by segment).
+    
+    MRG32k3a(name)        next stream of the package seed (like RngStream(name))
+    MRG32k3a(name, seed)  stream starting at seed (6 integers)
+    """
+    def __init__(self, name="", seed=None):
+        global _next_seed
+        self.name = name
+        if seed is None:
+            seed = _next_seed
+            _next_seed = list(advance_seed(_next_seed, streams=1))
+        self.SetSeed(seed)
+    
+    def __str__(self):
+        return "<MRG32k3a {} state:{}>".format(self.name, self.Cg)
+    
+    def SetSeed(self, seed):
+        check_seed(seed)
+        self.Ig = list(seed)  # start of the stream
+        self.Bg = list(seed)  # start of the current substream
+        self.Cg = list(seed)  # current state
+    
+    def GetState(self):
+        return list(self.Cg)
+    
+    def ResetStartStream(self):
+        self.Bg = list(self.Ig)
+        self.Cg = list(self.Ig)
+    
+    def ResetStartSubstream(self):
+        self.Cg = list(self.Bg)
+    
+    def ResetNextSubstream(self):
+        self.Bg = list(advance_seed(self.Bg, substreams=1))
+        self.Cg = list(self.Bg)
+    
+    def RandU01(self):
+        s = self.Cg
+        p1 = (1403580 * s[1] - 810728 * s[0]) % M1
+        s[0], s[1], s[2] = s[1], s[2], p1
+        p2 = (527612 * s[5] - 1370589 * s[3]) % M2
+        s[3], s[4], s[5] = s[4], s[5], p2
+        return ((p1 - p2) if p1 > p2 else (p1 - p2 + M1)) * NORM
+    
+    def nRandU01(self, n):
+        return self.fill(np.empty(n))
+    
+    def fill(self, out):
+        """ writes the next out.size uniforms into out (float64), returns out """
+        n = out.size
+        if n < MIN_VECTOR_FILL:
+            for j in range(n):
+                out.flat[j] = self.RandU01()
+            return out
+        if not out.flags.c_contiguous or out.dtype != np.float64:
+            out[...] = self.nRandU01(n).reshape(out.shape)
+            return out
+        if n > SEGMENT_VALUES:
+            flat = out.reshape(-1)
+            for begin in range(0, n, SEGMENT_VALUES):
+                self.fill(flat[begin:begin + SEGMENT_VALUES])
+            return out
+        # K = power of 2, so only a few jump tables are ever computed
+        lane_length = max(MIN_LANE_LENGTH, 1 << (-(-n // MAX_LANES) - 1).bit_length())
+        full = n // lane_length            # lanes written straight into out
+        rest = n - full * lane_length      # values of the last, partial lane
+        lanes = full + 1                   # the extra lane also yields the next state
+        jump1, jump2 = _lane_jumps(lane_length)
+        x10, x11, x12 = _jump_lanes(jump1, self.Cg[:3], lanes, M1)
+        x20, x21, x22 = _jump_lanes(jump2, self.Cg[3:], lanes, M2)
+        
+        grid = out.reshape(-1)[:full * lane_length].reshape(full, lane_length)
+        tail = out.reshape(-1)[full * lane_length:]
+        q = np.empty(lanes)
+        end_state = None
+        for step in range(lane_length):
+            if step == rest:
+                end_state = [int(x[-1]) for x in (x10, x11, x12, x20, x21, x22)]
+            # L'Ecuyer's double precision version: all products < 2^53 are exact, 
+            # floor(p / m) is the exact quotient
+            p1 = 1403580.0 * x11
+            p1 -= 810728.0 * x10
+            np.floor(p1 / M1, out=q)
+            p1 -= q * M1
+            x10, x11, x12 = x11, x12, p1
+            p2 = 527612.0 * x22
+            p2 -= 1370589.0 * x20
+            np.floor(p2 / M2, out=q)
+            p2 -= q * M2
+            x20, x21, x22 = x21, x22, p2
+            d = p1 - p2
+            d += M1 * (d <= 0)
+            np.multiply(d[:full], NORM, out=grid[:, step])
+            if step < rest:
+                tail[step] = d[-1] * NORM
+        self.Cg = end_state
+        return out
+
+
+def new_stream(name="ThothStream", seed=None, backend=None):
+    """
+    a generator with RandU01/nRandU01/SetSeed (and fill for backend "numpy")
+    seed = None: next stream of the package seed of the backend
+    """
+    backend = DEFAULT_BACKEND if backend is None else backend
+    if backend == "numpy":
+        return MRG32k3a(name, seed)
+    if backend == "rngstream":
+        # local file, only needed for this backend
+        import rngStream_n
+        stream = rngStream_n.RngStream(name)
+        if seed is not None:
+            stream.SetSeed(list(seed))
+        return stream
+    raise ValueError("No such backend: {}. Choose 'numpy' or 'rngstream'".format(backend))
+
+#------------------------------------------------------------------------------------------------------
+
+#------------------------------------   Stream factory ------------------------------------------------
+
+#------------------------------------------------------------------------------------------------------
+
+class StreamFactory:
+    """
+    Pass one factory into the constructors of all distributions of a model
+    (parameter streams=...). Each distribution gets its own stream, the
+    replication number selects the substream.
+
+    example:
+        streams = StreamFactory(replication=3)
+        arrivals = ExponentialDistribution(2, streams=streams)
+        service  = NormalDistribution(1, 0.1, streams=streams)
+    
+    antithetic = all uniform distributions built from this factory emit 1-u
+    registry   = shared {(name, k): stream index} of synchronized factories 
+                 (see synchronized()), None = streams in creation order
+    backend    = "numpy" (MRG32k3a) or "rngstream" (rngStream_n), None = DEFAULT_BACKEND
+    """
+    def __init__(self, seed=DEFAULT_SEED, replication=0, antithetic=False, registry=None, backend=None):
+        check_seed(seed)
+        if replication < 0 or replication >= 2**51:
+            raise ValueError("replication has to be in [0, 2^51), got {}".format(replication))
+        self.seed = tuple(seed)
+        self.replication = replication
+        self.antithetic = antithetic
+        self.registry = registry
+        self.backend = backend
+        self.name_counts = {}
+        self.consumers = 0  # number of streams handed out so far
+        # start of the replication's substream in stream 0, and the last stream seed
+        # handed out: the next stream is one jump (A^(2^127)) away, no matrix power per stream
+        self.base_seed = advance_seed(self.seed, substreams=replication)
+        self.last_seed = (0, self.base_seed)
+
+    def __str__(self):
+        return "<StreamFactory replication:{}, streams handed out:{}>".format(self.replication, self.consumers)
+
+    def stream_seed(self, consumer):
+        # stream and substream jumps commute (powers of the same matrix)
+        last, seed = self.last_seed
+        if consumer == last + 1:
+            seed = tuple(_mat_vec(A1P127, seed[:3], M1) + _mat_vec(A2P127, seed[3:], M2))
+        elif consumer != last:
+            seed = advance_seed(self.base_seed, streams=consumer)
+        self.last_seed = (consumer, seed)
+        return seed
+    
+    def __next_index(self, name):
+        if self.registry is None:
+            return self.consumers
+        # k-th stream of that name, the same key gets the same stream in all synchronized factories
+        k = self.name_counts.get(name, 0)
+        self.name_counts[name] = k + 1
+        return self.registry.setdefault((name, k), len(self.registry))
+
+    def next_stream(self, name="ThothStream"):
+        stream = new_stream(name, self.stream_seed(self.__next_index(name)), self.backend)
+        self.consumers += 1
+        return stream
+    
+    def scope(self, label):
+        """ streams for a part of the model, named label/<name> (use with synchronized factories) """
+        return StreamScope(self, label)
+
+    def for_replication(self, replication):
+        """ a fresh factory with the same seed for another replication """
+        return StreamFactory(self.seed, replication, self.antithetic, backend=self.backend)
+    
+    def antithetic_twin(self):
+        """ a fresh factory with the same streams, mirrored (u -> 1-u) """
+        return StreamFactory(self.seed, self.replication, not self.antithetic, self.registry, self.backend)
+    
+    def synchronized(self):
+        """
+        A factory for a second model variant using common random numbers:
+        both factories hand out the same stream for the same (name, k), where k
+        counts the streams of that name, no matter in which order they are created.
+        Use scope(label) to name the parts of the models.
+        
+        example:
+            streams_a = StreamFactory(replication=r)
+            streams_b = streams_a.synchronized()
+            arrivals_a = ExponentialDistribution(2, streams=streams_a.scope("arrivals"))
+            arrivals_b = ExponentialDistribution(2, streams=streams_b.scope("arrivals"))
+        """
+        if self.registry is None:
+            if self.consumers > 0:
+                raise ValueError("synchronized() has to be called before the factory hands out streams")
+            self.registry = {}
+        return StreamFactory(self.seed, self.replication, self.antithetic, self.registry, self.backend)
+
+
+class StreamScope:
+    """
+    Prefixes the stream names of a StreamFactory, can be passed as streams=... 
+    """
+    def __init__(self, factory, label):
+        self.factory = factory
+        self.label = label
+        self.antithetic = factory.antithetic
+    
+    def __str__(self):
+        return "<StreamScope {} of {}>".format(self.label, self.factory)
+    
+    def next_stream(self, name="ThothStream"):
+        return self.factory.next_stream("{}/{}".format(self.label, name))
+    
+    def scope(self, label):
+        return StreamScope(self.factory, "{}/{}".format(self.label, label))
+
+#------------------------------------------------------------------------------------------------------
+
+#------------------------------------   Parallel replications -----------------------------------------
+
+#------------------------------------------------------------------------------------------------------
+
+def _run_replication(job):
+    fn, seed, replication, antithetic = job
+    streams = StreamFactory(seed, replication)
+    if not antithetic:
+        return fn(streams)
+    return (fn(streams) + fn(streams.antithetic_twin())) / 2
+
+def run_replications(fn, n, workers=None, seed=DEFAULT_SEED, chunksize=1, antithetic=False):
+    """
+    fn           = one replication, called as fn(streams) with a StreamFactory
+                   (has to be picklable, i.e. defined on module level)
+    n            = number of replications
+    [workers]    = size of the process pool (None = all cores, 1 = no pool)
+    [antithetic] = every replication returns the mean of an antithetic pair
+                   (fn(streams) + fn(streams.antithetic_twin())) / 2
+
+    returns [fn(StreamFactory(seed, 0)), ..., fn(StreamFactory(seed, n-1))]
+
+    Replication r always uses substream r, so the results are bit-identical
+    for any number of workers and any scheduling of the pool.
+    """
+    jobs = [(fn, seed, replication, antithetic) for replication in range(n)]
+    if workers == 1:
+        return [_run_replication(job) for job in jobs]
+    with multiprocessing.Pool(workers) as pool:
+        return pool.map(_run_replication, jobs, chunksize)
+
+#------------------------------------------------------------------------------------------------------
+
+#-------------------------------------------    Playground  ------------------------------------------
+
+#------------------------------------------------------------------------------------------------------
+
+def check_fill_segments(n=3 * SEGMENT_VALUES + 1000):
+    """ a large (segmented) fill equals chunked fills and the scalar generator """
+    seed = (1, 2, 3, 4, 5, 6)
+    whole_gen, chunked_gen = MRG32k3a("whole", seed), MRG32k3a("chunked", seed)
+    whole = whole_gen.fill(np.empty(n))
+    chunked = np.concatenate([chunked_gen.fill(np.empty(size)) for size in (100, 600, 70000, n - 70700)])
+    assert np.array_equal(whole, chunked) and whole_gen.GetState() == chunked_gen.GetState()
+    # values around the first segment border, from the scalar recurrence
+    k = SEGMENT_VALUES - 500
+    start = _mat_vec(_mat_pow(A1, k, M1), seed[:3], M1) + _mat_vec(_mat_pow(A2, k, M2), seed[3:], M2)
+    reference = MRG32k3a("reference", start)
+    assert np.array_equal(whole[k:k + 1000], [reference.RandU01() for _ in range(1000)])
+    print("fill segments: ok")
+
+#uncomment to test
+#check_fill_segments()
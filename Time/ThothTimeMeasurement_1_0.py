@@ -5,6 +5,9 @@ Created on Fri Feb 26 12:58:58 2020
 @author: Lukas Baur
 
 This framework helps timing program subroutines
+
+    - Timer:     start/stop of single sections (last measurement per identifier)
+    - Profiler:  nested scopes with call tree, per scope statistics and self time
 """
 
 #------------------------------------------------------------------------------------------------------ 
@@ -41,6 +44,251 @@ class Timer():
         return self.measured_times[identifier]
 
 
+#------------------------------------------------------------------------------------------------------ 
+        
+#---------------------------------------   Profiling -------------------------------------------------- 
+
+
+#------------------------------------------------------------------------------------------------------ 
+
+class _CallNode:
+    """
+    one node of the call tree (= identifier at one call path), 
+    inclusive times in ns, mean/m2 updated incrementally (Welford)
+    """
+    __slots__ = ("identifier", "parent", "children", "count", "total", "min", "max", "mean", "m2")
+    
+    def __init__(self, identifier, parent):
+        self.identifier = identifier
+        self.parent = parent
+        self.children = {}
+        self.count = 0
+        self.total = 0
+        self.min = float('inf')
+        self.max = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+    
+    def add(self, dt):
+        self.count += 1
+        self.total += dt
+        if dt < self.min:
+            self.min = dt
+        if dt > self.max:
+            self.max = dt
+        delta = dt - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (dt - self.mean)
+    
+    def self_time(self):
+        """ inclusive time minus the inclusive time of the direct children """
+        return self.total - sum(child.total for child in self.children.values())
+    
+    def var(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else float('nan')
+
+
+class _Scope:
+    # one (reused) object per identifier, the start times are kept on the profiler's stack,
+    # so nested/recursive use of the same identifier works
+    __slots__ = ("profiler", "identifier")
+    
+    def __init__(self, profiler, identifier):
+        self.profiler = profiler
+        self.identifier = identifier
+    
+    def __enter__(self):
+        profiler = self.profiler
+        parent = profiler.current
+        node = parent.children.get(self.identifier)
+        if node is None:
+            node = parent.children[self.identifier] = _CallNode(self.identifier, parent)
+        profiler.current = node
+        profiler.starts.append(time.perf_counter_ns())
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        dt = time.perf_counter_ns() - self.profiler.starts.pop()
+        node = self.profiler.current
+        # _CallNode.add inlined (saves a call per scope)
+        node.count += 1
+        node.total += dt
+        if dt < node.min:
+            node.min = dt
+        if dt > node.max:
+            node.max = dt
+        delta = dt - node.mean
+        node.mean += delta / node.count
+        node.m2 += delta * (dt - node.mean)
+        self.profiler.current = node.parent
+
+
+class _NoScope:
+    # scope of a disabled profiler
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NO_SCOPE = _NoScope()
+
+
+class Profiler():
+    """
+    Nested timing scopes (time.perf_counter_ns: monotonic, ns resolution).
+    Every identifier gets a node per call path (call tree), each node aggregates 
+    count, total, min, max, mean and variance over all its runs.
+    self time = inclusive time - inclusive time of the nested scopes.
+    
+    usage:
+        profiler = Profiler()
+        with profiler.scope("simulation"):
+            with profiler.scope("arrivals"):
+                ...
+        
+        @profiler.profile()             # identifier = function name
+        def step():
+            ...
+        
+        profiler.start("io") ... profiler.stop("io")   # like Timer, scopes have to be nested
+        
+        profiler.print_report()
+        profiler.stats()["arrivals"]["mean"]
+    
+    enabled=False turns all scopes into no-ops (one attribute check).
+    One profiler per thread, the current scope is not thread local.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.root = _CallNode("<root>", None)
+        self.current = self.root
+        self.starts = []   # start times of the open scopes
+        self.scopes = {}   # identifier: _Scope
+    
+    def __str__(self):
+        return "<Profiler object, scopes:{}, enabled:{}>".format(len(self.stats()), self.enabled)
+    
+    def scope(self, identifier):
+        """ context manager timing the with block """
+        if not self.enabled:
+            return _NO_SCOPE
+        scope = self.scopes.get(identifier)
+        if scope is None:
+            scope = self.scopes[identifier] = _Scope(self, identifier)
+        return scope
+    
+    def profile(self, identifier=None):
+        """ decorator timing every call of the function """
+        def decorator(fn):
+            name = fn.__qualname__ if identifier is None else identifier
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                # inlined _Scope (no scope object per call)
+                parent = self.current
+                node = parent.children.get(name)
+                if node is None:
+                    node = parent.children[name] = _CallNode(name, parent)
+                self.current = node
+                start = time.perf_counter_ns()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    node.add(time.perf_counter_ns() - start)
+                    self.current = parent
+            wrapper.__name__ = fn.__name__
+            wrapper.__qualname__ = fn.__qualname__
+            wrapper.__doc__ = fn.__doc__
+            return wrapper
+        return decorator
+    
+    def start(self, identifier):
+        if not self.enabled:
+            return
+        parent = self.current
+        node = parent.children.get(identifier)
+        if node is None:
+            node = parent.children[identifier] = _CallNode(identifier, parent)
+        self.current = node
+        self.starts.append(time.perf_counter_ns())
+    
+    def stop(self, identifier):
+        """ returns the time of this run in seconds """
+        if not self.enabled:
+            return 0.0
+        end = time.perf_counter_ns()
+        if self.current is self.root or self.current.identifier != identifier:
+            raise ValueError("stop('{}') does not match the innermost open scope".format(identifier))
+        dt = end - self.starts.pop()
+        self.current.add(dt)
+        self.current = self.current.parent
+        return dt * 1e-9
+    
+    def reset(self):
+        self.root = _CallNode("<root>", None)
+        self.current = self.root
+        self.starts = []
+    
+    def nodes(self):
+        """ (depth, node) of the call tree in depth first order """
+        stack = [(0, child) for child in reversed(list(self.root.children.values()))]
+        while stack:
+            depth, node = stack.pop()
+            yield depth, node
+            stack.extend((depth + 1, child) for child in reversed(list(node.children.values())))
+    
+    def stats(self):
+        """
+        per identifier over all call paths (times in seconds):
+            {identifier: {count, total, self, min, max, mean, var}}
+        (the runs of a recursive scope are counted on every level)
+        """
+        result = {}
+        for _, node in self.nodes():
+            if node.count == 0:
+                continue
+            entry = result.get(node.identifier)
+            if entry is None:
+                result[node.identifier] = {"count": node.count, "total": node.total, "self": node.self_time(),
+                                           "min": node.min, "max": node.max, "mean": node.mean, "m2": node.m2}
+                continue
+            # parallel variance formula (Chan et al.)
+            n = entry["count"] + node.count
+            delta = node.mean - entry["mean"]
+            entry["m2"] += node.m2 + delta * delta * entry["count"] * node.count / n
+            entry["mean"] += delta * node.count / n
+            entry["count"] = n
+            entry["total"] += node.total
+            entry["self"] += node.self_time()
+            entry["min"] = min(entry["min"], node.min)
+            entry["max"] = max(entry["max"], node.max)
+        for entry in result.values():
+            m2 = entry.pop("m2")
+            entry["var"] = m2 / (entry["count"] - 1) * 1e-18 if entry["count"] > 1 else float('nan')
+            for key in ("total", "self", "min", "max", "mean"):
+                entry[key] *= 1e-9
+        return result
+    
+    def report(self):
+        """ the call tree as text (times in ms) """
+        lines = ["{:40s} {:>9s} {:>12s} {:>12s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+                 "scope", "count", "total", "self", "mean", "std", "min", "max")]
+        for depth, node in self.nodes():
+            if node.count == 0:
+                continue
+            std = node.var() ** 0.5 if node.count > 1 else 0.0
+            lines.append("{:40s} {:9d} {:12.3f} {:12.3f} {:10.4f} {:10.4f} {:10.4f} {:10.4f}".format(
+                "  " * depth + str(node.identifier), node.count, node.total * 1e-6, node.self_time() * 1e-6, 
+                node.mean * 1e-6, std * 1e-6, node.min * 1e-6, node.max * 1e-6))
+        return "\n".join(lines)
+    
+    def print_report(self):
+        print(self.report())
+
+
 #------------------------------------------------------------------------------------------------------ 
         
 #---------------------------------------   Example usage -------------------------------------------- 
@@ -70,4 +318,61 @@ def plot_example_usage():
     # get timing results
     for timer_id in ['whole Programm', 'subroutine 1', 'subroutine 2']:
         delta_time = timer.time_needed(timer_id)
-        print("time needen for {}: {}s".format(timer_id, delta_time))
\ No newline at end of file
+        print("time needen for {}: {}s".format(timer_id, delta_time))
+
+
+def benchmark_profiler_overhead(n=10**6):
+    """ cost per scope: with-scope, decorator, start/stop and a disabled profiler """
+    profiler = Profiler()
+    disabled = Profiler(enabled=False)
+    
+    def plain():
+        pass
+    decorated = profiler.profile("decorated")(plain)
+    
+    def measure(name, run):
+        start = time.perf_counter_ns()
+        run()
+        return name, (time.perf_counter_ns() - start) / n
+    
+    def loop_only():
+        for _ in range(n):
+            pass
+    def call_only():
+        for _ in range(n):
+            plain()
+    def with_scope():
+        scope = profiler.scope
+        for _ in range(n):
+            with scope("scope"):
+                pass
+    def with_decorator():
+        for _ in range(n):
+            decorated()
+    def start_stop():
+        for _ in range(n):
+            profiler.start("start/stop")
+            profiler.stop("start/stop")
+    def with_disabled():
+        scope = disabled.scope
+        for _ in range(n):
+            with scope("disabled"):
+                pass
+    
+    _, loop = measure("loop", loop_only)
+    _, call = measure("call", call_only)
+    for name, ns in [measure("with scope", with_scope), measure("start/stop", start_stop), 
+                     measure("disabled scope", with_disabled)]:
+        print("{:16s} {:6.0f} ns/scope".format(name, ns - loop))
+    name, ns = measure("decorator", with_decorator)
+    print("{:16s} {:6.0f} ns/call (on top of the plain call)".format(name, ns - call))
+    # how much of the measured time is overhead inside the scope (timer calls)
+    with profiler.scope("empty scopes"):
+        for _ in range(1000):
+            with profiler.scope("empty"):
+                pass
+    print("measured time of an empty scope: {:.0f} ns".format(profiler.stats()["empty"]["mean"] * 1e9))
+
+#uncomment to test
+#plot_example_usage()
+#benchmark_profiler_overhead()